@@ -0,0 +1,63 @@
+"""
+Rating aggregates of the companies - number_of_reviews, points_total, current_score and the number of reviews with each number of stars (stars_1 to stars_5).
+They are kept up to date by triggers on the reviews table (see migrations.py), so only approved reviews count. This module checks and rebuilds them from scratch.
+"""
+
+# actual aggregates of every company next to the stored ones, computed in one pass over reviews
+DRIFT_QUERY = """
+SELECT companies.id, companies.company_name, companies.number_of_reviews, companies.points_total, companies.current_score,
+    companies.stars_1, companies.stars_2, companies.stars_3, companies.stars_4, companies.stars_5,
+    COALESCE(totals.count, 0) AS actual_number_of_reviews, COALESCE(totals.total, 0) AS actual_points_total,
+    COALESCE(totals.stars_1, 0) AS actual_stars_1, COALESCE(totals.stars_2, 0) AS actual_stars_2, COALESCE(totals.stars_3, 0) AS actual_stars_3,
+    COALESCE(totals.stars_4, 0) AS actual_stars_4, COALESCE(totals.stars_5, 0) AS actual_stars_5
+FROM companies LEFT JOIN (
+    SELECT company_id, COUNT(*) AS count, SUM(rating) AS total,
+        SUM(rating = 1) AS stars_1, SUM(rating = 2) AS stars_2, SUM(rating = 3) AS stars_3, SUM(rating = 4) AS stars_4, SUM(rating = 5) AS stars_5
+    FROM reviews GROUP BY company_id
+) AS totals
+ON totals.company_id = companies.id
+"""
+
+# rewrite the aggregates of the companies that differ from the actual ones. Their version is bumped as well - the cached pages of the corrected companies show the old numbers
+RECOMPUTE = """
+UPDATE companies SET version = companies.version + 1, number_of_reviews = totals.count, points_total = totals.total,
+    current_score = CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END,
+    stars_1 = totals.stars_1, stars_2 = totals.stars_2, stars_3 = totals.stars_3, stars_4 = totals.stars_4, stars_5 = totals.stars_5
+FROM (SELECT companies.id AS company_id, COUNT(reviews.id) AS count, COALESCE(SUM(reviews.rating), 0) AS total,
+        COALESCE(SUM(reviews.rating = 1), 0) AS stars_1, COALESCE(SUM(reviews.rating = 2), 0) AS stars_2, COALESCE(SUM(reviews.rating = 3), 0) AS stars_3,
+        COALESCE(SUM(reviews.rating = 4), 0) AS stars_4, COALESCE(SUM(reviews.rating = 5), 0) AS stars_5
+    FROM companies LEFT JOIN reviews ON reviews.company_id = companies.id GROUP BY companies.id) AS totals
+WHERE companies.id = totals.company_id
+    AND (companies.number_of_reviews != totals.count OR companies.points_total != totals.total
+    OR abs(companies.current_score - CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END) > 1e-9
+    OR companies.stars_1 != totals.stars_1 OR companies.stars_2 != totals.stars_2 OR companies.stars_3 != totals.stars_3
+    OR companies.stars_4 != totals.stars_4 OR companies.stars_5 != totals.stars_5)
+"""
+
+STARS = ["stars_1", "stars_2", "stars_3", "stars_4", "stars_5"]
+
+
+def find_drift(db):
+    """Companies whose stored aggregates differ from their approved reviews"""
+    drift = []
+    for company in db.execute(DRIFT_QUERY):
+        count = company["actual_number_of_reviews"]
+        total = company["actual_points_total"]
+        score = total / count if count else 0.0
+        if (
+            company["number_of_reviews"] != count
+            or company["points_total"] != total
+            or abs(company["current_score"] - score) > 1e-9
+            or any(company[column] != company[f"actual_{column}"] for column in STARS)
+        ):
+            drift.append(company)
+    return drift
+
+
+def recompute(db):
+    """Rebuild the aggregates of all companies. Returns the number of companies corrected."""
+    with db.transaction():
+        corrected = [company["id"] for company in find_drift(db)]
+        if corrected:
+            db.execute(RECOMPUTE)
+    return len(corrected)
@@ -1,15 +1,28 @@
 import os
 import datetime
-import csv
-import locale
+import json
 import sqlite3
-from cs50 import SQL
-from flask import Flask, flash, redirect, render_template, request, session
+import click
+from flask import Flask, flash, jsonify, make_response, redirect, render_template, request, session, url_for
 from flask_session import Session
-from email_validator import validate_email, EmailNotValidError
-from flask_bcrypt import Bcrypt
+from email_validator import EmailNotValidError
 from flask_mail import Mail, Message
-from functions import login_required, apology
+from functions import login_required, admin_required, apology, fts_query, highlight
+from hashing import PasswordHasher, HashingBusy
+from database import Database
+import migrations
+from company_names import CompanyNameIndex, fold, prefix_range, slug, word_starts
+from collation import czech_key
+from reference_data import ReferenceData
+from outbox import Outbox
+from email_check import EmailChecker
+from query_stats import QueryStats
+from http_cache import HttpCache
+from fragment_cache import FragmentCache, MemoryBackend, SQLiteBackend
+from rate_limit import RateLimiter, MemoryStore, SQLiteStore
+from markupsafe import Markup
+import aggregates
+import leaderboard
 
 # Configure application
 app = Flask(__name__)
@@ -17,18 +30,22 @@ app = Flask(__name__)
 email_password = os.getenv("web_app_companies_review_password")
 email_username = os.getenv("web_app_companies_review_username")
 
-# create an instance of a bcrypt object
-bcrypt = Bcrypt(app)
+# create an instance of a bcrypt object. Passwords are hashed in a pool of processes (see hashing.py), the work factor of new hashes is set by BCRYPT_LOG_ROUNDS
+bcrypt = PasswordHasher(
+    rounds=int(os.getenv("BCRYPT_LOG_ROUNDS", "12")),
+    workers=int(os.getenv("BCRYPT_WORKERS", "0")) or None,
+    max_pending=int(os.getenv("BCRYPT_MAX_PENDING", "0")) or None,
+)
 
 # Used from CS50's finance problem set - Configure session to use filesystem (instead of signed cookies)
 app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
 Session(app)
 
-# Flask mail config
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
+# Flask mail config. The server can be changed through environment variables, e.g. to a local SMTP server for testing (python -m aiosmtpd -n -l localhost:1025 with MAIL_SERVER=localhost, MAIL_PORT=1025, MAIL_USE_TLS=0)
+app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER", "smtp.gmail.com")
+app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", "587"))
+app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "1") == "1"
 app.config["MAIL_USE_SSL"] = False
 app.config["MAIL_USERNAME"] = email_username
 app.config["MAIL_PASSWORD"] = email_password
@@ -36,45 +53,208 @@ app.config["MAIL_PASSWORD"] = email_password
 # create an instance of flask mail object
 mail = Mail(app)
 
-# made with help from chatGPT - to enable accurate sorting in accordance with local special characters(like "Ř", "Ž", "Š")
-locale.setlocale(locale.LC_ALL, "Czech")
+
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    """Too many logins at once - reject the request instead of letting it wait"""
+    response = make_response(apology("Server je momentálně přetížen. Zkuste to prosím za chvíli znovu.", 503))
+    response.headers["Retry-After"] = "5"
+    return response
 
 
 # used from CS50's finance problem set
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
+    """Ensure responses aren't cached, unless the route has its own cache policy (see http_cache.py)"""
+    if "Cache-Control" in response.headers:
+        return response
     response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     response.headers["Expires"] = 0
     response.headers["Pragma"] = "no-cache"
     return response
 
 
-db = SQL("sqlite:///review.db")
+# one sqlite3 connection per thread in WAL mode - see database.py
+db = Database("review.db")
+# pending schema migrations are applied on startup (see migrations.py). With MIGRATE_ON_STARTUP=0 they have to be applied with 'flask db-upgrade' before the app is started
+if os.getenv("MIGRATE_ON_STARTUP", "1") == "1":
+    migrations.migrate(db, log=app.logger.info)
+
+# statements are counted and timed per request and added up per route - see /admin_diagnostics. Statements slower than SLOW_QUERY_MS are logged (into the SLOW_QUERY_LOG file if set). SQL_STATS=0 turns this off
+query_stats = None
+if os.getenv("SQL_STATS", "1") == "1":
+    query_stats = QueryStats(
+        app,
+        db,
+        slow_threshold=float(os.getenv("SLOW_QUERY_MS", "100")) / 1000,
+        log_path=os.getenv("SLOW_QUERY_LOG"),
+    )
+
+# public pages are revalidated with ETags made from the data_versions counters, static files are fingerprinted and cached for long
+http_cache = HttpCache(app, db)
+
+# rendered company pages, cached per version of the company. FRAGMENT_CACHE=sqlite shares them between worker processes through a separate sqlite file (FRAGMENT_CACHE_PATH)
+if os.getenv("FRAGMENT_CACHE", "memory") == "sqlite":
+    fragment_cache = FragmentCache(SQLiteBackend(os.getenv("FRAGMENT_CACHE_PATH", "fragment_cache.db")))
+else:
+    fragment_cache = FragmentCache(MemoryBackend(int(os.getenv("FRAGMENT_CACHE_MB", "32")) * 1024 * 1024))
+
+# POSTs to the routes that hash passwords, look up email domains or send mail are limited per IP adress and per user (see rate_limit.py). RATE_LIMIT=sqlite shares the counts between worker processes through a separate sqlite file (RATE_LIMIT_PATH), RATE_LIMIT=0 turns the limits off
+if os.getenv("RATE_LIMIT", "memory") == "sqlite":
+    rate_limiter = RateLimiter(SQLiteStore(os.getenv("RATE_LIMIT_PATH", "rate_limit.db")))
+elif os.getenv("RATE_LIMIT", "memory") == "0":
+    rate_limiter = RateLimiter(None)
+else:
+    rate_limiter = RateLimiter(MemoryStore())
+
+# company names shared by all requests of this process - for searching, suggestions and for checking that a company exists
+company_name_index = CompanyNameIndex(db)
+# types of companies and regions offered when adding a company
+reference_data = ReferenceData(os.path.join(app.root_path, "company_types.csv"))
+
+# emails are not sent by the request handlers - they are stored in the outbox table and sent in the background.
+# Every worker process runs a sender thread unless OUTBOX_WORKER=0, in which case 'flask send-mail' has to run as a separate process
+outbox = Outbox(app, db, mail, email_username)
+if os.getenv("OUTBOX_WORKER", "1") == "1":
+    outbox.start_worker()
+
+
+# email adresses are checked with cached DNS lookups. EMAIL_DELIVERABILITY=deferred checks only the syntax while the user waits and leaves the DNS lookup to a background thread (or to 'flask verify-emails' if EMAIL_CHECK_WORKER=0)
+# the thread runs in the inline mode as well - adresses whose DNS lookup timed out are checked again by it
+email_checker = EmailChecker(os.getenv("EMAIL_DELIVERABILITY", "inline"))
+if os.getenv("EMAIL_CHECK_WORKER", "1") == "1":
+    email_checker.start_worker(app, db)
+
+
+@app.cli.command("db-upgrade")
+@click.option("--backup", is_flag=True, help="Copy the database to review.db.bak-<time> first.")
+def db_upgrade_command(backup):
+    """Apply the pending schema migrations"""
+    if backup and migrations.pending(db):
+        path = f"review.db.bak-{datetime.datetime.now():%Y%m%d%H%M%S}"
+        migrations.backup(db, path)
+        click.echo(f"Database copied to {path}.")
+    applied = migrations.migrate(db, log=click.echo)
+    click.echo(f"Applied {len(applied)} migrations.")
+
+
+@app.cli.command("db-status")
+def db_status_command():
+    """Show the schema version of the database and the migrations not applied yet"""
+    click.echo(f"Schema version: {migrations.current_version(db)}")
+    for version, name, steps in migrations.pending(db):
+        click.echo(f"Pending: {version} {name}")
+
+
+@app.cli.command("verify-emails")
+def verify_emails_command():
+    """Check the email domains of the accounts waiting for it"""
+    checked = email_checker.verify_pending(db)
+    click.echo(f"Checked {checked} accounts.")
+
+
+@app.cli.command("recompute-scores")
+@click.option("--check", is_flag=True, help="Only report the companies whose aggregates differ.")
+def recompute_scores_command(check):
+    """Rebuild the rating aggregates of all companies from the approved reviews and report the ones that were wrong"""
+    drift = aggregates.find_drift(db)
+    for company in drift:
+        click.echo(
+            f"{company['id']} {company['company_name']}: {company['number_of_reviews']} reviews / {company['points_total']} points stored, {company['actual_number_of_reviews']} / {company['actual_points_total']} actual"
+        )
+    if check:
+        click.echo(f"{len(drift)} companies differ.")
+    else:
+        click.echo(f"{aggregates.recompute(db)} companies corrected.")
+
+
+@app.cli.command("refresh-leaderboards")
+@click.option("--weight", type=float, default=leaderboard.PRIOR_WEIGHT, show_default=True, help="How many reviews of the average rating every company is assumed to have.")
+def refresh_leaderboards_command(weight):
+    """Compute the average rating of all reviews again and rebuild the leaderboards with it"""
+    prior, count = leaderboard.refresh(db, weight)
+    click.echo(f"{count} companies ranked, mean rating {prior['mean']:.3f}, weight {prior['weight']:g}.")
+
+
+@app.cli.command("send-mail")
+@click.option("--once", is_flag=True, help="Send the messages that are due and exit.")
+def send_mail_command(once):
+    """Send the emails waiting in the outbox"""
+    if once:
+        sent = outbox.send_pending()
+        click.echo(f"Sent {sent} emails.")
+    else:
+        outbox.run()
+
+
+@app.cli.command("outbox-stats")
+def outbox_stats_command():
+    """Show the queue depth and latencies of the outbox"""
+    for key, value in outbox.stats().items():
+        click.echo(f"{key}: {value}")
+
+# number of reviews shown on one page of the home feed
+FEED_PAGE_SIZE = 20
+
+
+def get_feed_page(before=None, before_id=None):
+    """
+    Get one page of the home feed, the most recent reviews first.
+    The page is ordered and limited in SQL. The cursor of the next page is the (date_time, id) of the last review shown, or None if there is nothing more to show.
+    """
+    # one more row than needed tells us whether there is a next page
+    if before and before_id:
+        reviews = db.execute(
+            "SELECT reviews.id, reviews.review_text, reviews.rating, reviews.date_time, companies.company_name, companies.company_type, users.name FROM reviews JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id WHERE (reviews.date_time, reviews.id) < (?, ?) ORDER BY reviews.date_time DESC, reviews.id DESC LIMIT ?",
+            before,
+            before_id,
+            FEED_PAGE_SIZE + 1,
+        )
+    else:
+        reviews = db.execute(
+            "SELECT reviews.id, reviews.review_text, reviews.rating, reviews.date_time, companies.company_name, companies.company_type, users.name FROM reviews JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id ORDER BY reviews.date_time DESC, reviews.id DESC LIMIT ?",
+            FEED_PAGE_SIZE + 1,
+        )
+    next_cursor = None
+    if len(reviews) > FEED_PAGE_SIZE:
+        reviews = reviews[:FEED_PAGE_SIZE]
+        next_cursor = {"before": reviews[-1]["date_time"], "before_id": reviews[-1]["id"]}
+    return reviews, next_cursor
 
 
 @app.route("/")
+@http_cache.public("reviews", "companies")
 def index():
     """Show homepage"""
-    # get all companies' names for the search bar
-    company_names_all = db.execute("SELECT company_name FROM companies")
-    company_names = []
-    for i in company_names_all:
-        company_names.append(i["company_name"])
-    # sorting made with help from chatGPT
-    company_names = sorted(company_names, key=lambda name: locale.strxfrm(name.lower()))
-
-    # get all the data that is beng shown on the home screen
-    reviews = db.execute(
-        "SELECT reviews.review_text, reviews.rating, reviews.date_time, companies.company_name, companies.company_type, users.name FROM reviews JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id;"
+    # get the first page of the reviews shown on the home screen, the most recent come first. The rest is loaded through /feed
+    reviews, next_cursor = get_feed_page()
+    return render_template(
+        "index.html",
+        reviews=reviews,
+        next_cursor=next_cursor,
     )
-    # sort the data based on time in reverse, so that the most recent comes first
-    reviews = sorted(reviews, key=lambda x: x["date_time"], reverse=True)
-    return render_template("index.html", reviews=reviews, company_names=company_names)
+
+
+@app.route("/feed")
+@http_cache.public("reviews", "companies")
+def feed():
+    """Serve the next page of the home feed as a html fragment, or as json if asked for"""
+    before = request.args.get("before")
+    before_id = request.args.get("before_id", type=int)
+    # both parts of the cursor are needed, otherwise the first page is served
+    if not before or not before_id:
+        before, before_id = None, None
+    reviews, next_cursor = get_feed_page(before, before_id)
+
+    if request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json":
+        return jsonify(reviews=reviews, next_cursor=next_cursor)
+    return render_template("feed_page.html", reviews=reviews, next_cursor=next_cursor)
 
 
 # login function adapted from CS50's Finance problem set
 @app.route("/login", methods=["GET", "POST"])
+@rate_limiter.limit("login", "10/60")
 def login():
     """Log user in"""
 
@@ -102,6 +282,14 @@ def login():
         ):
             return apology("Neplatný email nebo heslo")
 
+        # hashes made with an older work factor are upgraded now that we know the password
+        if bcrypt.needs_rehash(rows[0]["hash"]):
+            db.execute(
+                "UPDATE users SET hash = ? WHERE id = ?",
+                bcrypt.generate_password_hash(request.form.get("password")),
+                rows[0]["id"],
+            )
+
         # Remember which user has logged in
         session["user_id"] = rows[0]["id"]
         # added remembering the current users role to enable admin-specific functionality
@@ -128,6 +316,7 @@ def logout():
 
 # register function adapted from CS50's finance problem set
 @app.route("/register", methods=["GET", "POST"])
+@rate_limiter.limit("register", "5/600")
 def register():
     """Register user"""
 
@@ -147,11 +336,9 @@ def register():
         
         # email validation via addon. Checks the body of the email adress via regex and checks whether the adress provided can receive mail - therefore only valid adresses are permitted.
         # https://pypi.org/project/email-validator/
+        # the DNS lookups are cached per domain and may be deferred - see email_check.py
         try:
-            emailinfo = validate_email(
-                request.form.get("email"), check_deliverability=True
-            )
-            email = emailinfo.normalized
+            email, email_status = email_checker.validate(request.form.get("email"))
         except EmailNotValidError:
             return apology("Tato emailová adresa je neplatná")
 
@@ -165,18 +352,17 @@ def register():
         else:
             role = "user"
         # Password hash - via https://www.geeksforgeeks.org/password-hashing-with-bcrypt-in-flask/
-        password = bcrypt.generate_password_hash(request.form.get("password")).decode(
-            "utf-8"
-        )
+        password = bcrypt.generate_password_hash(request.form.get("password"))
 
         # Try to insert the user.
         try:
             db.execute(
-                "INSERT INTO users(email, name, hash, role) VALUES(?, ?, ?, ?)",
+                "INSERT INTO users(email, name, hash, role, email_status) VALUES(?, ?, ?, ?, ?)",
                 email,
                 name,
                 password,
                 role,
+                email_status,
             )
         # If valueError is raised we can infer that the username already exists. sqlite3.IntegrityError added per chatGPT advice after unexpected behaviour. 
         except (ValueError, sqlite3.IntegrityError):
@@ -189,7 +375,7 @@ def register():
             recipients=[email],
         )
         msg.body = "Právě jste se zaregistrovali na stránku recenze-společností.cz! Jsme rádi, že Vás tu máme."
-        mail.send(msg)
+        outbox.enqueue(msg)
         # If all is well, we can return the user to login page
         return redirect("/login")
 
@@ -222,6 +408,10 @@ def add_company():
         company_name = request.form.get("company_name")
         company_type = request.form.get("company_type")
         company_location = request.form.get("company_location")
+        # only the types and locations offered by the form are accepted
+        lists = reference_data.get()
+        if company_type not in lists.type_set or company_location not in lists.region_set:
+            return apology("Neplatný typ nebo umístění společnosti")
         company_web = ""
         company_adress = ""
         # assigning non-compulsory variables
@@ -232,59 +422,43 @@ def add_company():
 
         # adding a company to the db. If it already exists, it will raise a value error.
         try:
-            db.execute(
-                "INSERT INTO companies(company_name, company_type, company_location, company_web, company_adress) VALUES(?, ?, ?, ?, ?)",
-                company_name,
-                company_type,
-                company_location,
-                company_web,
-                company_adress,
-            )
+            name_key = fold(company_name)
+            with db.transaction():
+                company_id = db.execute(
+                    "INSERT INTO companies(company_name, company_type, company_location, company_web, company_adress, sort_key, name_key) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                    company_name,
+                    company_type,
+                    company_location,
+                    company_web,
+                    company_adress,
+                    czech_key(company_name),
+                    name_key,
+                )
+                # the parts of the name starting at its further words, for the suggestions
+                for word in word_starts(name_key):
+                    db.execute("INSERT OR IGNORE INTO company_words (word, company_id) VALUES (?, ?)", word, company_id)
         # If valueError is raised we can infer that the company_name already exists.
         except ValueError:
             return apology("Toto jméno společnosti již je používáno")
+        company_name_index.add(company_id, company_name)
 
         # Flashing a message as an confirmation of success
         flash("Společnost byla přidána!")
         # redirecting the user to add a review - ideally to the company he added just now
         return redirect("/add_review")
     else:
-        # get company types dynamically from a csv file so that it can be easily changed later
-        company_types = []
-        # create a list of possible locations - all counties within Czechia
-        company_locations = [
-            "Hlavní město Praha",
-            "Středočeský kraj",
-            "Jihočeský kraj",
-            "Plzeňský kraj",
-            "Karlovarský kraj",
-            "Ústecký kraj",
-            "Liberecký kraj",
-            "Královéhradecký kraj",
-            "Pardubický kraj",
-            "Kraj Vysočina",
-            "Jihomoravský kraj",
-            "Zlínský kraj",
-            "Olomoucký kraj",
-            "Moravskoslezský kraj",
-        ]
-        with open("company_types.csv", "r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                company_types.append(row[0])
-        # sorting made with help from chatGPT
-        company_types = sorted(
-            company_types, key=lambda name: locale.strxfrm(name.lower())
-        )
+        # company types come from a csv file so that they can be easily changed later, the locations are all counties within Czechia - see reference_data.py
+        lists = reference_data.get()
         return render_template(
             "add_company.html",
-            company_types=company_types,
-            company_locations=company_locations,
+            company_types=lists.types,
+            company_locations=lists.regions,
         )
 
 
 @app.route("/add_review", methods=["GET", "POST"])
 @login_required
+@rate_limiter.limit("add_review", "20/3600")
 def add_review():
     if request.method == "POST":
         # error checking
@@ -294,14 +468,8 @@ def add_review():
             or not request.form.get("company_review")
         ):
             return apology("Neplatná recenze")
-        # get the names of all companies in the db for the searchbar
-        company_names_all = db.execute("SELECT company_name FROM companies")
-        # make a list of the company names in the db - for easier showing
-        company_names = []
-        for i in company_names_all:
-            company_names.append(i["company_name"])
         # if company does not exist - flash that it does not exist and redirect the user to add_company
-        if request.form.get("company_name") not in company_names:
+        if request.form.get("company_name") not in company_name_index:
             flash("Neplatné jméno společnosti. Nejdříve přidejte novou společnost.")
             return redirect("/add_company")
         # safeguard
@@ -329,25 +497,8 @@ def add_review():
             date_time,
         )
 
-        # appending the companies table with current data
-        current_company_data = db.execute(
-            "SELECT current_score, number_of_reviews, points_total FROM companies WHERE id = ?",
-            company_id,
-        )
-        current_company_rating = float(current_company_data[0]["current_score"])
-        current_number_of_reviews = int(current_company_data[0]["number_of_reviews"])
-        points_total = int(current_company_data[0]["points_total"])
-        new_points_total = points_total + company_rating
-        new_number_of_reviews = current_number_of_reviews + 1
-        new_company_rating = new_points_total / new_number_of_reviews
-        db.execute(
-            "UPDATE companies SET number_of_reviews = ?, current_score = ?, points_total = ? WHERE id = ?",
-            new_number_of_reviews,
-            new_company_rating,
-            new_points_total,
-            company_id
-        )
-        
+        # the rating of the company changes only once the review is approved - triggers on the reviews table take care of it
+
         # get the current users email and send a confirmation email
         user_email = db.execute("SELECT email FROM users WHERE id = ?", user_id)
         msg = Message(
@@ -356,7 +507,7 @@ def add_review():
             recipients=[user_email[0]["email"]],
         )
         msg.body = f"Vaše recenze na firmu: {company_name} byla úspěšně vložena. Text vaší recenze: {company_review}. Vaše hodnocení této firmy je {company_rating} z 5ti. O schválení vaší recenze Vás budeme informovat emailem."
-        mail.send(msg)
+        outbox.enqueue(msg)
         # flash confirmation in case of success
         flash(
             "Recenze přidána! O jejím schválení administrátorem Vás budeme informovat emailem."
@@ -364,93 +515,423 @@ def add_review():
         # redirect to homepage
         return redirect("/")
     else:
-        # get the current list of registered companies to the add_review.html so that the user knows which companies already exist and therefore can be reviewed
-        company_names_all = db.execute("SELECT company_name FROM companies")
-        company_names = []
-        for i in company_names_all:
-            company_names.append(i["company_name"])
-        # sorting made with help from chatGPT
-        company_names = sorted(
-            company_names, key=lambda name: locale.strxfrm(name.lower())
+        # the search bar gets the names of existing companies from /api/companies/suggest while the user types
+        return render_template("add_review.html")
+
+
+# number of reviews shown on one page of a company
+COMPANY_PAGE_SIZE = 20
+
+# orders of the reviews on a company page - the ORDER BY, the columns of the cursor and how the next page compares to it. Each order is read straight from an index on (company_id, date_time) or (company_id, rating, date_time)
+COMPANY_SORTS = {
+    "newest": ("reviews.date_time DESC, reviews.id DESC", ("date_time", "id"), "<"),
+    "oldest": ("reviews.date_time, reviews.id", ("date_time", "id"), ">"),
+    "highest": ("reviews.rating DESC, reviews.date_time DESC, reviews.id DESC", ("rating", "date_time", "id"), "<"),
+    "lowest": ("reviews.rating, reviews.date_time, reviews.id", ("rating", "date_time", "id"), ">"),
+}
+
+
+def get_company_reviews(company_id, sort="newest", stars=None, cursor=None):
+    """
+    Get one page of the reviews of a company.
+    cursor is the position of the last review of the previous page ("rating|date_time|id" or "date_time|id" depending on the order). Returns the reviews and the cursor of the next page, or None if there is nothing more to show.
+    """
+    order, columns, comparison = COMPANY_SORTS[sort]
+    conditions = ["reviews.company_id = ?"]
+    args = [company_id]
+    if stars:
+        conditions.append("reviews.rating = ?")
+        args.append(stars)
+    if cursor:
+        parts = cursor.split("|")
+        # a broken cursor shows the first page
+        if len(parts) == len(columns):
+            try:
+                values = [parts[0]] if columns[0] == "date_time" else [int(parts[0]), parts[1]]
+                values.append(int(parts[-1]))
+            except ValueError:
+                values = None
+            if values:
+                conditions.append(f"({', '.join('reviews.' + column for column in columns)}) {comparison} ({', '.join('?' * len(columns))})")
+                args.extend(values)
+    # one more row than needed tells us whether there is a next page
+    company_reviews = db.execute(
+        f"SELECT reviews.id, reviews.review_text, reviews.rating, reviews.date_time, users.name FROM reviews JOIN users ON reviews.user_id = users.id WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?",
+        *args,
+        COMPANY_PAGE_SIZE + 1,
+    )
+    next_cursor = None
+    if len(company_reviews) > COMPANY_PAGE_SIZE:
+        company_reviews = company_reviews[:COMPANY_PAGE_SIZE]
+        next_cursor = "|".join(str(company_reviews[-1][column]) for column in columns)
+    return company_reviews, next_cursor
+
+
+# most companies listed when a search on /reviews matches more of them
+REVIEWS_MATCH_LIMIT = 100
+
+
+def company_fragment(company, sort="newest", stars=None, cursor=None):
+    """The company with one page of its' reviews rendered as html - from the cache if none of its' reviews changed since"""
+
+    def render():
+        company_reviews, next_cursor = get_company_reviews(company["id"], sort, stars, cursor)
+        return render_template(
+            "company_fragment.html",
+            company=company,
+            slug=slug(company["company_name"]),
+            company_reviews=company_reviews,
+            next_cursor=next_cursor,
+            sort=sort,
+            stars=stars,
         )
-        return render_template("add_review.html", company_names=company_names)
+
+    return Markup(fragment_cache.get_or_render(f"company:{company['id']}:{company['version']}:{sort}:{stars}:{cursor}", render))
+
+
+def company_json(company):
+    """The public information about a company with the number of its' reviews with each number of stars ("1" to "5"), as kept up to date by the triggers"""
+    return {
+        "id": company["id"],
+        "company_name": company["company_name"],
+        "company_type": company["company_type"],
+        "company_location": company["company_location"],
+        "company_web": company["company_web"],
+        "company_adress": company["company_adress"],
+        "current_score": company["current_score"],
+        "number_of_reviews": company["number_of_reviews"],
+        "stars": {str(stars): company[f"stars_{stars}"] for stars in range(1, 6)},
+    }
+
+
+@app.route("/company/<int:company_id>")
+@app.route("/company/<int:company_id>/<company_slug>")
+@http_cache.public("reviews", "companies")
+def company(company_id, company_slug=None):
+    """Page of one company with its' reviews, sortable (?sort=newest|oldest|highest|lowest), filtered by the number of stars (?stars=1..5) and paginated (?cursor=...). ?format=json returns the same as json"""
+    rows = db.execute("SELECT * FROM companies WHERE id = ?", company_id)
+    if not rows:
+        return apology("Tato společnost neexistuje", 404)
+    company = rows[0]
+    # the name in the url is there for people and search engines - a missing or outdated one is redirected to the current one
+    if company_slug != slug(company["company_name"]):
+        # only the arguments of the page are kept - others could clash with the arguments of url_for()
+        args = {key: value for key, value in request.args.items() if key in ("sort", "stars", "cursor", "format")}
+        return redirect(url_for("company", company_id=company_id, company_slug=slug(company["company_name"]), **args), 301)
+
+    sort = request.args.get("sort", "newest")
+    if sort not in COMPANY_SORTS:
+        sort = "newest"
+    stars = request.args.get("stars", type=int)
+    if stars not in range(1, 6):
+        stars = None
+    cursor = request.args.get("cursor") or None
+    if request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json":
+        company_reviews, next_cursor = get_company_reviews(company["id"], sort, stars, cursor)
+        return jsonify(company=company_json(company), reviews=company_reviews, next_cursor=next_cursor)
+    fragment = company_fragment(company, sort, stars, cursor)
+    return render_template("company.html", company=company, fragment=fragment)
 
 
 @app.route("/reviews", methods=["GET", "POST"])
+@http_cache.public()
 def reviews():
     if request.method == "POST":
-        # get all company names for the search algorithm
-        company_names_all = db.execute("SELECT company_name FROM companies")
-        company_names = []
-        for i in company_names_all:
-            company_names.append(i["company_name"])
         # error checking
         if not request.form.get("company_name"):
             return apology("Musíte vložit jméno společnosti")
 
-        # case insensitive search algorithm for partial inputs
-        we_have_it = False
-        company_name_flag = ""
-        companies_found_count = 0
-        companies_found = []
-        searched_name = request.form.get("company_name").lower()
-        for i in company_names:
-            if searched_name in i.lower():
-                we_have_it = True
-                company_name_flag = i
-                companies_found.append(i)
-                companies_found_count += 1
+        # case and diacritics insensitive search for partial inputs, done on the in-memory index
+        companies_found = company_name_index.substring_ids(request.form.get("company_name"))
 
         # if the company is not in the db - a flash message is shown and the user is redirected to adding a company. 
-        if we_have_it == False:
+        if not companies_found:
             flash("Tato společnost zatím neexistuje. Přidejte ji. Pro přidání nové společnosti se musíte zaregistrovat a přihlásit.")
             return redirect("/add_review")
-           
-
-        # if there are more companies that match the (partial) input:
-        if companies_found_count > 1:
-            company = []
-            warning_text = "Takových společností máme v databázi několik. Vyberte si prosím jednu z nich."
-            # append all their data to the list
-            for i in companies_found:
-                temp = db.execute("SELECT * FROM companies WHERE company_name = ?", i)
-                if temp:
-                    company.extend(temp)
-            # and return all of them so the user can choose
-            return render_template(
-                "reviews.html",
-                company=company,
-                company_names=company_names,
-                warning_text=warning_text,
-            )
 
-        # else, if only one company was found: get its' data
+        # exactly one company - its' page has its' own url
+        if len(companies_found) == 1:
+            company = db.execute("SELECT id, company_name FROM companies WHERE id = ?", companies_found[0])
+            return redirect(url_for("company", company_id=company[0]["id"], company_slug=slug(company[0]["company_name"])))
+
+        # if there are more companies that match the (partial) input: the first ones in Czech alphabetical order, sorted by the sort_key index. The ids are passed as one json list, as there may be more of them than sqlite allows parameters
+        warning_text = "Takových společností máme v databázi několik. Vyberte si prosím jednu z nich."
         company = db.execute(
-            "SELECT * FROM companies WHERE company_name = ?", company_name_flag
-        )
-        # get its' reviews with associated user
-        company_reviews = db.execute(
-            "SELECT * FROM reviews JOIN users ON reviews.user_id = users.id WHERE company_id = ?",
-            company[0]["id"],
+            "SELECT * FROM companies WHERE id IN (SELECT value FROM json_each(?)) ORDER BY sort_key LIMIT ?",
+            json.dumps(companies_found),
+            REVIEWS_MATCH_LIMIT,
         )
-        # and return it
+        # and return all of them so the user can choose
         return render_template(
             "reviews.html",
             company=company,
-            company_names=company_names,
-            company_reviews=company_reviews,
+            warning_text=warning_text,
         )
     else:
-        # get all companies' names for the search bar
-        company_names_all = db.execute("SELECT company_name FROM companies")
-        company_names = []
-        for i in company_names_all:
-            company_names.append(i["company_name"])
-        # sorting made with help from chatGPT
-        company_names = sorted(
-            company_names, key=lambda name: locale.strxfrm(name.lower())
+        # the search bar gets the names of existing companies from /api/companies/suggest while the user types
+        return render_template("reviews.html")
+
+
+# how many suggestions the search bars get
+SUGGEST_LIMIT = 10
+
+
+@app.route("/api/companies/suggest")
+@http_cache.public("companies", "reviews")
+def suggest_companies():
+    """
+    Company names for the search bars - names starting with the input first, then names with a further word starting with it.
+    Companies with more reviews come first in both groups. Every company matching the input is ranked, read by a range search over the folded names (companies.name_key and company_words).
+    """
+    query = request.args.get("q", "").strip()
+    limit = min(max(request.args.get("limit", SUGGEST_LIMIT, type=int), 1), SUGGEST_LIMIT)
+    suggestions = []
+    bounds = prefix_range(query)
+    if bounds:
+        low, high = bounds
+        suggestions = db.execute(
+            "SELECT id, company_name, number_of_reviews FROM companies WHERE name_key >= ? AND name_key < ? ORDER BY number_of_reviews DESC, sort_key LIMIT ?",
+            low,
+            high,
+            limit,
+        )
+        if len(suggestions) < limit:
+            # the companies found above are left out - they start with the input as a whole
+            suggestions += db.execute(
+                "SELECT companies.id, companies.company_name, companies.number_of_reviews FROM companies WHERE companies.id IN (SELECT company_id FROM company_words WHERE word >= ? AND word < ?) AND NOT (companies.name_key >= ? AND companies.name_key < ?) ORDER BY companies.number_of_reviews DESC, companies.sort_key LIMIT ?",
+                low,
+                high,
+                low,
+                high,
+                limit - len(suggestions),
+            )
+    return jsonify(suggestions)
+
+
+# number of companies shown on one page of the browse page
+BROWSE_PAGE_SIZE = 20
+
+# orders of the browse page - the column sorted by, the best first. Served by the indexes on (company_type, column), (company_location, column) and (column)
+BROWSE_SORTS = {
+    "score": "current_score",
+    "reviews": "number_of_reviews",
+}
+
+
+def get_facets(company_type=None, company_location=None):
+    """
+    Number of companies of every type (within the chosen region) and in every region (of the chosen type), and the number matching both.
+    Summed from the small company_facets table kept up to date by triggers.
+    """
+    rows = db.execute("SELECT company_type, company_location, companies FROM company_facets")
+    types = {}
+    locations = {}
+    total = 0
+    for row in rows:
+        if not company_location or row["company_location"] == company_location:
+            types[row["company_type"]] = types.get(row["company_type"], 0) + row["companies"]
+        if not company_type or row["company_type"] == company_type:
+            locations[row["company_location"]] = locations.get(row["company_location"], 0) + row["companies"]
+        if (not company_type or row["company_type"] == company_type) and (not company_location or row["company_location"] == company_location):
+            total += row["companies"]
+    return {
+        "types": [{"value": value, "count": types[value]} for value in sorted(types, key=czech_key)],
+        "regions": [{"value": value, "count": locations[value]} for value in sorted(locations, key=czech_key)],
+        "total": total,
+    }
+
+
+def get_companies_page(company_type=None, company_location=None, sort="score", cursor=None):
+    """One page of companies of the type and region (None for any), and the cursor ("value|id" of the last company) of the next page or None"""
+    column = BROWSE_SORTS[sort]
+    conditions = []
+    args = []
+    if company_type:
+        conditions.append("company_type = ?")
+        args.append(company_type)
+    if company_location:
+        conditions.append("company_location = ?")
+        args.append(company_location)
+    if cursor:
+        value, _, last_id = cursor.partition("|")
+        # a broken cursor shows the first page
+        try:
+            values = [float(value) if column == "current_score" else int(value), int(last_id)]
+        except ValueError:
+            values = None
+        if values:
+            conditions.append(f"({column}, id) < (?, ?)")
+            args.extend(values)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # one more row than needed tells us whether there is a next page
+    companies = db.execute(
+        f"SELECT id, company_name, company_type, company_location, current_score, number_of_reviews, stars_1, stars_2, stars_3, stars_4, stars_5 FROM companies {where} ORDER BY {column} DESC, id DESC LIMIT ?",
+        *args,
+        BROWSE_PAGE_SIZE + 1,
+    )
+    next_cursor = None
+    if len(companies) > BROWSE_PAGE_SIZE:
+        companies = companies[:BROWSE_PAGE_SIZE]
+        next_cursor = f"{companies[-1][column]}|{companies[-1]['id']}"
+    for company in companies:
+        company["slug"] = slug(company["company_name"])
+    return companies, next_cursor
+
+
+def browse_args():
+    """Filters, order and cursor of the browse page from the query string"""
+    sort = request.args.get("sort", "score")
+    if sort not in BROWSE_SORTS:
+        sort = "score"
+    return request.args.get("type") or None, request.args.get("region") or None, sort, request.args.get("cursor") or None
+
+
+@app.route("/companies")
+@http_cache.public("companies", "reviews")
+def browse_companies():
+    """Companies filtered by type (?type=) and region (?region=), sorted by score or by the number of reviews (?sort=score|reviews), with the number of companies for every option of the filters"""
+    company_type, company_location, sort, cursor = browse_args()
+    companies, next_cursor = get_companies_page(company_type, company_location, sort, cursor)
+    return render_template(
+        "companies.html",
+        companies=companies,
+        next_cursor=next_cursor,
+        facets=get_facets(company_type, company_location),
+        company_type=company_type,
+        company_location=company_location,
+        sort=sort,
+    )
+
+
+@app.route("/api/companies")
+@http_cache.public("companies", "reviews")
+def api_companies():
+    """The same as /companies as json"""
+    company_type, company_location, sort, cursor = browse_args()
+    companies, next_cursor = get_companies_page(company_type, company_location, sort, cursor)
+    return jsonify(companies=companies, next_cursor=next_cursor, facets=get_facets(company_type, company_location))
+
+
+# number of companies on a leaderboard, unless asked for less (?limit=)
+LEADERBOARD_SIZE = 20
+LEADERBOARD_MAX_SIZE = 100
+
+
+def leaderboard_args():
+    """Type, region and length of the leaderboard from the query string"""
+    limit = request.args.get("limit", LEADERBOARD_SIZE, type=int)
+    limit = min(max(limit, 1), LEADERBOARD_MAX_SIZE)
+    return request.args.get("type") or None, request.args.get("region") or None, limit
+
+
+@app.route("/leaderboard")
+@http_cache.public("companies", "reviews", "leaderboard")
+def leaderboard_page():
+    """The best companies overall, of a type (?type=) or in a region (?region=), ranked by the Bayesian average of their ratings (see leaderboard.py)"""
+    company_type, company_location, limit = leaderboard_args()
+    companies = leaderboard.top(db, limit, company_type, company_location)
+    for company in companies:
+        company["slug"] = slug(company["company_name"])
+    lists = reference_data.get()
+    return render_template(
+        "leaderboard.html",
+        companies=companies,
+        company_types=lists.types,
+        company_locations=lists.regions,
+        company_type=company_type,
+        company_location=company_location,
+    )
+
+
+@app.route("/api/leaderboard")
+@http_cache.public("companies", "reviews", "leaderboard")
+def api_leaderboard():
+    """The same as /leaderboard as json"""
+    company_type, company_location, limit = leaderboard_args()
+    return jsonify(companies=leaderboard.top(db, limit, company_type, company_location))
+
+
+# number of results shown on one page of the full text search
+SEARCH_PAGE_SIZE = 20
+
+
+@app.route("/search_reviews")
+@http_cache.public("reviews", "companies")
+def search_reviews():
+    """Full text search over the texts of the approved reviews, the best matches first"""
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    match = fts_query(query)
+    results = []
+    has_next = False
+    if match:
+        # bm25() ranks the matches, snippet() cuts out the part of the text around them. One more row than needed tells us whether there is a next page
+        results = db.execute(
+            "SELECT reviews.id, reviews.rating, reviews.date_time, companies.company_name, users.name, snippet(reviews_fts, 0, char(2), char(3), '…', 16) AS snippet FROM reviews_fts JOIN reviews ON reviews.id = reviews_fts.rowid JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id WHERE reviews_fts MATCH ? ORDER BY bm25(reviews_fts) LIMIT ? OFFSET ?",
+            match,
+            SEARCH_PAGE_SIZE + 1,
+            (page - 1) * SEARCH_PAGE_SIZE,
         )
-        return render_template("reviews.html", company_names=company_names)
+        if len(results) > SEARCH_PAGE_SIZE:
+            results = results[:SEARCH_PAGE_SIZE]
+            has_next = True
+        for result in results:
+            result["snippet"] = highlight(result["snippet"])
+
+    if request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json":
+        for result in results:
+            result["snippet"] = str(result["snippet"])
+        return jsonify(results=results, page=page, has_next=has_next)
+    return render_template(
+        "search_reviews.html",
+        query=query,
+        results=results,
+        page=page,
+        has_next=has_next,
+    )
+
+
+# number of reviews on one page of the account page
+ACCOUNT_PAGE_SIZE = 20
+
+# a review can be edited for three days after it was written (or last edited). Dates are stored in local time
+EDIT_WINDOW = "reviews.date_time > datetime('now', 'localtime', '-3 days')"
+
+
+def get_own_review(review_id, user_id):
+    """
+    The review with the id if it was written by the user, otherwise None.
+    'editable' tells whether it is still within the edit window - every route editing reviews checks it through this function.
+    """
+    rows = db.execute(
+        f"SELECT reviews.id, reviews.review_text, length(reviews.review_text) AS review_length, reviews.rating, reviews.date_time, companies.company_name, users.email, {EDIT_WINDOW} AS editable FROM reviews JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id WHERE reviews.id = ? AND reviews.user_id = ?",
+        review_id,
+        user_id,
+    )
+    return rows[0] if rows else None
+
+
+def get_user_reviews(user_id, cursor=None):
+    """One page of the approved reviews of the user, the most recent first, and the cursor ("date_time|id" of the last one) of the next page or None"""
+    conditions = "reviews.user_id = ?"
+    args = [user_id]
+    if cursor:
+        date_time, _, last_id = cursor.rpartition("|")
+        # a broken cursor shows the first page
+        if date_time and last_id.isdigit():
+            conditions += " AND (reviews.date_time, reviews.id) < (?, ?)"
+            args += [date_time, int(last_id)]
+    # state tells the page whether changing the review is still allowed. One more row than needed tells us whether there is a next page
+    user_reviews = db.execute(
+        f"SELECT reviews.review_text, reviews.id, reviews.rating, reviews.date_time, companies.company_name, CASE WHEN {EDIT_WINDOW} THEN 'enabled' ELSE 'disabled' END AS state FROM reviews JOIN companies ON reviews.company_id = companies.id WHERE {conditions} ORDER BY reviews.date_time DESC, reviews.id DESC LIMIT ?",
+        *args,
+        ACCOUNT_PAGE_SIZE + 1,
+    )
+    next_cursor = None
+    if len(user_reviews) > ACCOUNT_PAGE_SIZE:
+        user_reviews = user_reviews[:ACCOUNT_PAGE_SIZE]
+        next_cursor = f"{user_reviews[-1]['date_time']}|{user_reviews[-1]['id']}"
+    return user_reviews, next_cursor
 
 
 @app.route("/account")
@@ -460,28 +941,14 @@ def search():
     user_id = session["user_id"]
     # get information about the user
     user = db.execute("SELECT * FROM users WHERE id = ?", user_id)
-    # get all reviews that the user has created and that were checked by the admin
-    user_reviews = db.execute(
-        "SELECT reviews.review_text, reviews.id, reviews.rating, reviews.date_time, companies.company_name FROM reviews JOIN companies ON reviews.company_id = companies.id WHERE user_id = ?",
-        user_id,
-    )
-    # datetime checking because there shall be a window of only three days for editing a review
-    for review in user_reviews:
-        review_date_check = review["date_time"]
-        review_date_check = datetime.datetime.strptime(
-            review_date_check, "%Y-%m-%d %H:%M:%S"
-        )
-        # based on the check, a new key:value pair is added to the data that the html gets. Based on this, changing a specific review is either allowed or not.
-        if (datetime.datetime.now() - datetime.timedelta(days=3)) > review_date_check:
-            review["state"] = "disabled"
-        else:
-            review["state"] = "enabled"
-    # sorting the reviews based on the date and time in reverse so that the most recent reviews come first
-    user_reviews = sorted(user_reviews, key=lambda x: x["date_time"], reverse=True)
-    return render_template("account.html", user=user, user_reviews=user_reviews)
+    # get one page of the reviews that the user has created and that were checked by the admin, the most recent first - read from the index on (user_id, date_time)
+    user_reviews, next_cursor = get_user_reviews(user_id, request.args.get("cursor") or None)
+    next_url = url_for("search", cursor=next_cursor) if next_cursor else None
+    return render_template("account.html", user=user, user_reviews=user_reviews, next_url=next_url)
 
 
 @app.route("/cookies_policy")
+@http_cache.public(max_age=3600)
 def cookies_policy():
     return render_template("cookies_policy.html")
 
@@ -489,12 +956,14 @@ def cookies_policy():
 
 
 @app.route("/privacy_policy")
+@http_cache.public(max_age=3600)
 def privacy_policy():
     return render_template("privacy_policy.html")
 
 # just plain html showing placeholder privacy policy
 
 @app.route("/terms_conditions")
+@http_cache.public(max_age=3600)
 def terms_conditions():
     return render_template("terms_conditions.html")
 
@@ -502,6 +971,7 @@ def terms_conditions():
 
 @app.route("/change_email", methods=["GET", "POST"])
 @login_required
+@rate_limiter.limit("change_email", "5/600")
 def change_email():
     if request.method == "POST":
         # general error checking - all fields must be filler
@@ -550,17 +1020,19 @@ def change_email():
 
         # is the new email adress legit? The same validation as in /register
         try:
-            emailinfo = validate_email(
-                request.form.get("new_email"), check_deliverability=True
-            )
-            email = emailinfo.normalized
+            email, email_status = email_checker.validate(request.form.get("new_email"))
         except EmailNotValidError:
             return apology("Nová emailová adresa je neplatná")
 
         # Try to change the email value of the user.
 
         try:
-            db.execute("UPDATE users SET email = ? WHERE id = ?", email, user_id)
+            db.execute(
+                "UPDATE users SET email = ?, email_status = ? WHERE id = ?",
+                email,
+                email_status,
+                user_id,
+            )
         # If valueError is raised we can infer that the email adress already exists. sqlite3.IntegrityError added per chatGPT advice after unexpected behaviour.
         except (ValueError, sqlite3.IntegrityError):
             return apology("Nová emailová adresa je již používána")
@@ -572,7 +1044,7 @@ def change_email():
             recipients=[email, request.form.get("current_email")],
         )
         msg.body = f"Právě jste změnili svou emailovou adresu na stránce: recenze společností. Vaše původní adresa: {request.form.get("current_email")}, vaše nová adresa: {email}"
-        mail.send(msg)
+        outbox.enqueue(msg)
 
         flash("E-mailová adresa změněna!")
         return redirect("/account")
@@ -582,6 +1054,7 @@ def change_email():
 
 @app.route("/change_password", methods=["GET", "POST"])
 @login_required
+@rate_limiter.limit("change_password", "5/600")
 def change_password():
     if request.method == "POST":
         # general error checking - all fields must be filler
@@ -621,9 +1094,7 @@ def change_password():
             return apology("Nové heslo se musí lišit od toho původního")
 
         # hashing the new password
-        new_hash = bcrypt.generate_password_hash(
-            request.form.get("new_password")
-        ).decode("utf-8")
+        new_hash = bcrypt.generate_password_hash(request.form.get("new_password"))
         db.execute("UPDATE users SET hash = ? WHERE id = ?", new_hash, user_id)
 
         # confirmation email
@@ -637,7 +1108,7 @@ def change_password():
         msg.body = (
             f"Právě jste změnili svoje přístupové heslo na stránce recenze-společností."
         )
-        mail.send(msg)
+        outbox.enqueue(msg)
 
         flash("Heslo bylo změněno")
         return redirect("/account")
@@ -649,27 +1120,17 @@ def change_password():
 @login_required
 def edit_review_passtrough():
     """Error checking and passing it through so that this function does not go through GET"""
-    # datetime checking because there shall be a window of only three days for editing a review
-    review = db.execute(
-        "SELECT date_time FROM reviews WHERE id = ?",
-        int(request.form.get("edit_review")),
-    )
-    review = review[0]["date_time"]
-    review = datetime.datetime.strptime(review, "%Y-%m-%d %H:%M:%S")
-    if (datetime.datetime.now() - datetime.timedelta(days=3)) > review:
+    review = get_own_review(request.form.get("edit_review", type=int), session["user_id"])
+    if not review:
+        return apology("Neplatná recenze")
+    # there shall be a window of only three days for editing a review
+    if not review["editable"]:
         return apology(
             "Toto hodnocení již nemůžete upravit. Doba na úpravu hodnocení jsou tři(3) dny."
         )
-    # get the current contents of the review and serve it to the user so that he can change it
-    review_id = request.form.get("edit_review")
-    review_content = db.execute(
-        "SELECT reviews.id, reviews.review_text, reviews.rating, reviews.date_time, companies.company_name FROM reviews JOIN companies ON reviews.company_id = companies.id WHERE reviews.id = ?",
-        review_id,
-    )
-    # the current review lenght for the character counter's initial value
-    length = len(review_content[0]["review_text"])
+    # serve the current contents of the review to the user so that he can change it, with its' lenght for the character counter's initial value
     return render_template(
-        "edit_review.html", review_content=review_content, length=length
+        "edit_review.html", review_content=[review], length=review["review_length"]
     )
 
 
@@ -685,38 +1146,50 @@ def edit_review():
     ):
         return apology("Chybně zadané údaje.")
     
+    # the review has to be the users' own and still within the edit window - the same check as in edit_review_passtrough
+    review = get_own_review(request.form.get("review_id", type=int), session["user_id"])
+    if not review:
+        return apology("Neplatná recenze")
+    if not review["editable"]:
+        return apology(
+            "Toto hodnocení již nemůžete upravit. Doba na úpravu hodnocení jsou tři(3) dny."
+        )
+
     # getting the updated values
     new_date_time = datetime.datetime.now()
     new_rating = int(request.form.get("company_rating"))
     new_review = request.form.get("company_review")
-    review_id = request.form.get("review_id")
-    
+
     # updating the review in the database
     db.execute(
         "UPDATE reviews SET review_text = ?, rating = ?, date_time = ? WHERE id = ?",
         new_review,
         new_rating,
         new_date_time,
-        review_id,
+        review["id"],
     )
 
     # send a confirmation message to the user
-    user_id = db.execute("SELECT user_id FROM reviews WHERE id = ?", review_id)
-    user_email = db.execute(
-        "SELECT email FROM users WHERE id = ?", int(user_id[0]["user_id"])
-    )
     msg = Message(
         "Na stránkách recenze-společností jste upravili jedno z Vašich hodnocení",
         sender=email_username,
-        recipients=[user_email[0]["email"]],
+        recipients=[review["email"]],
     )
-    msg.body = f"Právě jste upravili své hodnocení společnost: {request.form.get("company_name")}. Text vašeho nového hodnocení: {new_review}. Vaše nové hodnocení společnosti: {new_rating} z 5ti."
-    mail.send(msg)
+    msg.body = f"Právě jste upravili své hodnocení společnost: {review["company_name"]}. Text vašeho nového hodnocení: {new_review}. Vaše nové hodnocení společnosti: {new_rating} z 5ti."
+    outbox.enqueue(msg)
 
     flash("Recenze byla změněna!")
     return redirect("/account")
 
 
+def anonymous_user_id():
+    """Id of the anonymous user that the reviews of deleted accounts and deleted reviews are handed over to"""
+    rows = db.execute("SELECT id FROM users WHERE role = 'anonymous'")
+    if not rows:
+        raise RuntimeError("The anonymous user (role 'anonymous') is missing in the users table")
+    return rows[0]["id"]
+
+
 @app.route("/delete_review_passthrough", methods=["POST"])
 @login_required
 def delete_review_passtrough():
@@ -737,56 +1210,44 @@ def delete_review():
         "delete_review_id"
     ):
         return apology("Neplatně zadané údaje")
-    # get the data concerning the review to delete
     review_to_be_deleted_id = request.form.get("delete_review_id")
-    review_to_be_deleted = db.execute(
-        "SELECT review_text, rating, company_id, date_time FROM reviews WHERE id = ?",
-        review_to_be_deleted_id,
-    )
-    # anonymous user for this purpose
-    user_id = 5
-    review_text = review_to_be_deleted[0]["review_text"]
-    rating = int(review_to_be_deleted[0]["rating"])
-    company_id = int(review_to_be_deleted[0]["company_id"])
-    date_time = review_to_be_deleted[0]["date_time"]
-
-    # get the user id from the review before it is changed
-    user_id = db.execute(
-        "SELECT user_id FROM reviews WHERE id = ?", int(review_to_be_deleted_id)
-    )
-    user_email = db.execute(
-        "SELECT email FROM users WHERE id = ?", user_id[0]["user_id"]
-    )
-    company_name = db.execute(
-        "SELECT company_name FROM companies WHERE id = ?", company_id
-    )
 
-    # email confirmation
-    msg = Message(
-        "Na stránkách recenze-společností jste smazali jedno z Vašich hodnocení",
-        sender=email_username,
-        recipients=[user_email[0]["email"]],
-    )
-    msg.body = f"Právě jste smazali své hodnocení společnost: {company_name[0]["company_name"]}. Text vašeho nového hodnocení zůstane na stránce recenze-společností. Jakákoli jeho spojitost s vaší osobou bude smazána."
-    mail.send(msg)
+    # everything happens in one transaction - the review can not end up both deleted and not handed over, or the other way around
+    with db.transaction():
+        # get the data concerning the review to delete with its' author and company at once
+        review_to_be_deleted = db.execute(
+            "SELECT reviews.user_id, users.email, companies.company_name FROM reviews JOIN users ON reviews.user_id = users.id JOIN companies ON reviews.company_id = companies.id WHERE reviews.id = ?",
+            review_to_be_deleted_id,
+        )
+        # only the author can delete the review
+        if not review_to_be_deleted or review_to_be_deleted[0]["user_id"] != session["user_id"]:
+            return apology("Neplatně zadané údaje")
+
+        # put everything into temp_reviews table under the anonymous user, so that the admin can potentially anonymize the contents of the review and then put it back into the main reviews table
+        db.execute(
+            "INSERT INTO temp_reviews (review_text, rating, company_id, user_id, date_time) SELECT review_text, rating, company_id, ?, date_time FROM reviews WHERE id = ?",
+            anonymous_user_id(),
+            review_to_be_deleted_id,
+        )
+        # delete from reviews table the particular review the user selected - it will be put back later and anonymous
+        db.execute("DELETE FROM reviews WHERE id = ?", review_to_be_deleted_id)
+
+        # email confirmation
+        msg = Message(
+            "Na stránkách recenze-společností jste smazali jedno z Vašich hodnocení",
+            sender=email_username,
+            recipients=[review_to_be_deleted[0]["email"]],
+        )
+        msg.body = f"Právě jste smazali své hodnocení společnost: {review_to_be_deleted[0]["company_name"]}. Text vašeho nového hodnocení zůstane na stránce recenze-společností. Jakákoli jeho spojitost s vaší osobou bude smazána."
+        outbox.enqueue(msg)
 
-    # put everything into temp_reviews table, so that the admin can potentially anonymize the contents of the review and then put it back into the main reviews table
-    db.execute(
-        "INSERT INTO temp_reviews (review_text, rating, company_id, user_id, date_time) VALUES (?, ?, ?, ?, ?)",
-        review_text,
-        rating,
-        company_id,
-        user_id,
-        date_time,
-    )
-    # delete from reviews table the particular review the user selected - it will be put back later and anonymous
-    db.execute("DELETE FROM reviews WHERE id = ?", review_to_be_deleted_id)
     flash("Vaše spojení s touto recenzí bylo smazáno!")
     return redirect("/account")
 
 
 @app.route("/user_data", methods=["POST"])
 @login_required
+@rate_limiter.limit("user_data", "3/3600")
 def user_data():
     """
     This would allow users to ask for the copy of the data that has beec collected.
@@ -808,7 +1269,7 @@ def user_data():
         recipients=[user_email[0]["email"]],
     )
     msg.body = f"Právě jste na stránkách recenze-společností zažádal/a o kopii vašich uživatelských dat. Kopie vašich dat bude zaslána na Vaši emailovou adresu do 30ti dnů. S pozdravem, tým Recenze-společností."
-    mail.send(msg)
+    outbox.enqueue(msg)
 
     # get admin email
     admin_email = db.execute("SELECT email FROM users WHERE role = 'admin'")
@@ -819,7 +1280,7 @@ def user_data():
         recipients=[admin_email[0]["email"]],
     )
     msg.body = f"Uživatel s emailovou adresou: {user_email[0]["email"]} s id: {user_id} právě požádal o kopii svých uživatelských dat. Na splnění jeho požadavku máte 30 dnů."
-    mail.send(msg)
+    outbox.enqueue(msg)
     # confirmation flash
     flash(
         "Žádost o kopii Vašich dat byla odeslána. Kopii Vašich dat obdržíte do 30ti dnů!"
@@ -836,42 +1297,39 @@ def delete_account():
         if not request.form.get("confirmation_check"):
             return apology("Chybně zadaná data. Musíte souhlasit s podmínkami.")
         user_id = session["user_id"]
-        # get all of the users reviews and their ids.
-        all_review_ids = db.execute("SELECT id FROM reviews WHERE user_id = ?", user_id)
-        all_reviews_to_anonymize = db.execute(
-            "SELECT review_text, rating, company_id, date_time FROM reviews WHERE user_id = ?",
-            user_id,
-        )
 
-        # copy all review content to temp_reviews
-        for i, review in enumerate(range(len(all_reviews_to_anonymize))):
-            user_id_copy = 5
+        # the whole deletion is one transaction of a few set-based statements, so it takes the same time however many reviews the user wrote and a crash can not leave reviews duplicated or lost
+        with db.transaction():
+            anonymous_id = anonymous_user_id()
+            # copy all review content to temp_reviews under the anonymous user
+            db.execute(
+                "INSERT INTO temp_reviews (review_text, rating, company_id, user_id, date_time) SELECT review_text, rating, company_id, ?, date_time FROM reviews WHERE user_id = ?",
+                anonymous_id,
+                user_id,
+            )
+            # delete all user reviews from reviews
+            db.execute("DELETE FROM reviews WHERE user_id = ?", user_id)
+            # reviews still waiting for approval are handed over to the anonymous user as well
             db.execute(
-                "INSERT INTO temp_reviews (review_text, rating, company_id, user_id, date_time) VALUES (?, ?, ?, ?, ?)",
-                all_reviews_to_anonymize[i]["review_text"],
-                int(all_reviews_to_anonymize[i]["rating"]),
-                int(all_reviews_to_anonymize[i]["company_id"]),
-                user_id_copy,
-                all_reviews_to_anonymize[i]["date_time"],
+                "UPDATE temp_reviews SET user_id = ? WHERE user_id = ?",
+                anonymous_id,
+                user_id,
             )
 
-        # delete all user reviews from reviews
-        for id in all_review_ids:
-            db.execute("DELETE FROM reviews WHERE id = ?", id["id"])
+            # get user email
+            user_email = db.execute("SELECT email FROM users WHERE id = ?", user_id)
+            # send confirmation email
+            msg = Message(
+                "Účet smazán", sender=email_username, recipients=[user_email[0]["email"]]
+            )
+            msg.body = f"Váš uživatelský účet na stránkách recenze-společností byl smazán."
+            outbox.enqueue(msg)
 
-        # get user email
-        user_email = db.execute("SELECT email FROM users WHERE id = ?", user_id)
-        # send confirmation email
-        msg = Message(
-            "Účet smazán", sender=email_username, recipients=[user_email[0]["email"]]
-        )
-        msg.body = f"Váš uživatelský účet na stránkách recenze-společností byl smazán."
-        mail.send(msg)
+            # delete user from users
+            db.execute("DELETE FROM users WHERE id = ?", user_id)
 
         # log user out
         session.clear()
-        # delete user from users
-        db.execute("DELETE FROM users WHERE id = ?", user_id)
 
         # redirect the user to the main page and flash confirmation.
         flash("Uživatelský účet byl smazán.")
@@ -883,28 +1341,221 @@ def delete_account():
 """ADMIN FUNCTIONS"""
 
 
+# number of reviews on one page of each list of the admin console
+ADMIN_PAGE_SIZE = 50
+
+
+def admin_filters():
+    """Filters of the lists of the admin console from the query string - company name (or a part of it), user email or id, dates from and to (inclusive) and rating"""
+    filters = {}
+    for name in ("company", "user", "date_from", "date_to"):
+        value = request.args.get(name, "").strip()
+        if value:
+            filters[name] = value
+    rating = request.args.get("rating", type=int)
+    if rating in range(1, 6):
+        filters["rating"] = rating
+    return filters
+
+
+def admin_conditions(table, filters):
+    """SQL conditions and their arguments for the filters on temp_reviews or reviews"""
+    conditions = []
+    args = []
+    if "company" in filters:
+        # the ids are passed as one json list, as there may be more of them than sqlite allows parameters
+        conditions.append(f"{table}.company_id IN (SELECT value FROM json_each(?))")
+        args.append(json.dumps(company_name_index.substring_ids(filters["company"])))
+    if "user" in filters:
+        if filters["user"].isdigit():
+            conditions.append(f"{table}.user_id = ?")
+            args.append(int(filters["user"]))
+        else:
+            conditions.append(f"{table}.user_id = (SELECT id FROM users WHERE email = ?)")
+            args.append(filters["user"])
+    for name, comparison, days in (("date_from", ">=", 0), ("date_to", "<", 1)):
+        if name in filters:
+            try:
+                date = datetime.date.fromisoformat(filters[name]) + datetime.timedelta(days=days)
+            except ValueError:
+                continue
+            conditions.append(f"{table}.date_time {comparison} ?")
+            args.append(date)
+    if "rating" in filters:
+        conditions.append(f"{table}.rating = ?")
+        args.append(filters["rating"])
+    return conditions, args
+
+
+def get_admin_page(table, filters, cursor=None, newest_first=True):
+    """
+    One page of temp_reviews or reviews with the company name, the author and the length of the text, and the cursor ("date_time|id" of the last row) of the next page or None.
+    """
+    conditions, args = admin_conditions(table, filters)
+    comparison, direction = ("<", "DESC") if newest_first else (">", "")
+    if cursor:
+        date_time, _, last_id = cursor.rpartition("|")
+        if date_time and last_id.isdigit():
+            conditions.append(f"({table}.date_time, {table}.id) {comparison} (?, ?)")
+            args.extend([date_time, int(last_id)])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # one more row than needed tells us whether there is a next page
+    rows = db.execute(
+        f"SELECT {table}.id, {table}.review_text, length({table}.review_text) AS review_length, {table}.rating, {table}.company_id, {table}.user_id, {table}.date_time, companies.company_name, users.name, users.email FROM {table} JOIN companies ON {table}.company_id = companies.id JOIN users ON {table}.user_id = users.id {where} ORDER BY {table}.date_time {direction}, {table}.id {direction} LIMIT ?",
+        *args,
+        ADMIN_PAGE_SIZE + 1,
+    )
+    next_cursor = None
+    if len(rows) > ADMIN_PAGE_SIZE:
+        rows = rows[:ADMIN_PAGE_SIZE]
+        next_cursor = f"{rows[-1]['date_time']}|{rows[-1]['id']}"
+    return rows, next_cursor
+
+
 @app.route("/admin_index", methods=["GET"])
 @login_required
+@admin_required
 def admin_index():
+    """
+    Admin console - the reviews waiting for approval (the oldest first) and the approved reviews (the newest first), each paginated on its own (?queue_cursor=, ?reviews_cursor=).
+    Both lists can be filtered (see admin_filters()). ?format=json returns the same as json.
+    """
+    filters = admin_filters()
+    queue_cursor = request.args.get("queue_cursor") or None
+    reviews_cursor = request.args.get("reviews_cursor") or None
+    reviews_to_check, next_queue_cursor = get_admin_page("temp_reviews", filters, queue_cursor, newest_first=False)
+    all_reviews, next_reviews_cursor = get_admin_page("reviews", filters, reviews_cursor)
+    # counts of the whole tables, kept by triggers
+    summary = {row["name"]: row["count"] for row in db.execute("SELECT name, count FROM table_counts")}
+
+    if request.args.get("format") == "json":
+        return jsonify(
+            summary=summary,
+            filters=filters,
+            reviews_to_check=reviews_to_check,
+            next_queue_cursor=next_queue_cursor,
+            all_reviews=all_reviews,
+            next_reviews_cursor=next_reviews_cursor,
+        )
+    # links to the next page of one list keep the filters and the position in the other list
+    next_queue_url = None
+    if next_queue_cursor:
+        next_queue_url = url_for("admin_index", **filters, queue_cursor=next_queue_cursor, reviews_cursor=reviews_cursor)
+    next_reviews_url = None
+    if next_reviews_cursor:
+        next_reviews_url = url_for("admin_index", **filters, queue_cursor=queue_cursor, reviews_cursor=next_reviews_cursor)
+    return render_template(
+        "admin_index.html",
+        reviews_to_check=reviews_to_check,
+        all_reviews=all_reviews,
+        summary=summary,
+        filters=filters,
+        next_queue_url=next_queue_url,
+        next_reviews_url=next_reviews_url,
+    )
+
+
+@app.route("/admin_outbox", methods=["GET"])
+@login_required
+@admin_required
+def admin_outbox():
+    """Queue depth and latencies of the email outbox"""
+    return jsonify(outbox.stats())
+
+
+@app.route("/admin_diagnostics", methods=["GET", "POST"])
+@login_required
+@admin_required
+def admin_diagnostics():
+    """Number and time of the SQL statements per route, N+1 queries and the last slow statements of this process"""
+    if query_stats is None:
+        return apology("Měření SQL dotazů je vypnuté (SQL_STATS=0)")
+    if request.method == "POST":
+        query_stats.reset()
+        return redirect("/admin_diagnostics")
+    report = query_stats.report()
+    report["fragment_cache"] = fragment_cache.stats()
+    if request.args.get("format") == "json":
+        return jsonify(report)
+    return render_template("admin_diagnostics.html", report=report)
+
+
+# most reviews one bulk moderation request may handle
+BULK_MODERATION_LIMIT = 1000
+
+
+@app.route("/admin_bulk", methods=["POST"])
+@login_required
+@admin_required
+def admin_bulk():
+    """
+    Manages output from the admin console when more reviews from temp_reviews are selected at once.
+    action is "approve", "anonymize" (approve reviews of the anonymous user without notifying anyone - selected reviews of other users are left in the queue) or "reject".
+    The whole batch is moved or deleted in one transaction and every user gets one email about all of their reviews.
+    """
     # error checking
-    user_identity = db.execute("SELECT id FROM users WHERE role = 'admin'")
-    user_id = session["user_id"]
-    
-    # check whether the user accessing the admin console is authorised to do so
-    if user_id != user_identity[0]["id"]:
-        return apology("Nepovolený přístup")
-    
-    # get all the reviews to be checked and/or anonymized
-    reviews_to_check = db.execute("SELECT * FROM temp_reviews;")
-    # add a lenght parameter for the character count initial value
-    for review in reviews_to_check:
-        length = len(review["review_text"])
-        review["review_length"] = length
-        
-    # get all reviews sorted by time in reverse order so that there is an easy way to delete them later if they do not confirm to the terms and conditions.
-    all_reviews = db.execute("SELECT * FROM reviews")
-    all_reviews = sorted(all_reviews, key=lambda x: x["date_time"], reverse=True)
-    return render_template("admin_index.html", reviews_to_check=reviews_to_check, all_reviews=all_reviews)
+    action = request.form.get("action")
+    if action not in ("approve", "anonymize", "reject"):
+        return apology("Neplatná akce")
+    try:
+        review_ids = [int(review_id) for review_id in request.form.getlist("review_ids")]
+    except ValueError:
+        return apology("Chybná vstupní data")
+    if not review_ids:
+        return apology("Nebyla vybrána žádná recenze")
+    if len(review_ids) > BULK_MODERATION_LIMIT:
+        return apology(f"Najednou lze zpracovat nejvýše {BULK_MODERATION_LIMIT} recenzí")
+
+    conditions = "id IN (?)"
+    args = [review_ids]
+    # only reviews handed over to the anonymous user may be published without notifying anyone
+    if action == "anonymize":
+        conditions += " AND user_id = ?"
+        args.append(anonymous_user_id())
+
+    with db.transaction():
+        # authors of the selected reviews, for the notifications
+        authors = db.execute(
+            "SELECT users.email, users.role, COUNT(*) AS count FROM temp_reviews JOIN users ON temp_reviews.user_id = users.id WHERE temp_reviews.id IN (?) GROUP BY users.id",
+            review_ids,
+        )
+        # approved reviews are copied into the reviews table as they are
+        if action in ("approve", "anonymize"):
+            db.execute(
+                f"INSERT INTO reviews (review_text, rating, company_id, user_id, date_time) SELECT review_text, rating, company_id, user_id, date_time FROM temp_reviews WHERE {conditions} ORDER BY id",
+                *args,
+            )
+        # remove the reviews from temp_reviews
+        moved = db.execute(f"DELETE FROM temp_reviews WHERE {conditions}", *args)
+
+        # one email per user - the outbox is written in the same transaction, so nobody is notified about a change that did not happen
+        if action != "anonymize":
+            for author in authors:
+                if author["role"] == "anonymous":
+                    continue
+                if action == "approve":
+                    msg = Message(
+                        "Vaše recenze na stránkách Recenze-společnosti byla schválena",
+                        sender=email_username,
+                        recipients=[author["email"]],
+                    )
+                    msg.body = f"Počet Vámi přidaných recenzí, které byly právě schváleny administrátorem a přidány mezi ostatní recenze: {author['count']}. Tým Recenze-společností."
+                else:
+                    msg = Message(
+                        "Vaše recenze na stránkách Recenze-společnosti byla zamítnuta",
+                        sender=email_username,
+                        recipients=[author["email"]],
+                    )
+                    msg.body = f"Počet Vámi přidaných recenzí, které byly administrátorem zamítnuty: {author['count']}. Vaše recenze bohužel nejsou v souladu s našimi uživatelskými podmínkami. Podmínky můžete nalézt na adrese: {'127.0.0.1:5000/terms_conditions'}. Tým Recenze-společností."
+                outbox.enqueue(msg)
+
+    if action == "reject":
+        flash(f"Počet smazaných recenzí z tabulky temp_reviews: {moved}.")
+    elif action == "anonymize" and moved < len(review_ids):
+        flash(f"Počet recenzí přesunutých do tabulky reviews: {moved}. Recenze, které nepatří anonymnímu uživateli, zůstaly ve frontě: {len(review_ids) - moved}.")
+    else:
+        flash(f"Počet recenzí přesunutých do tabulky reviews: {moved}.")
+    return redirect("/admin_index")
 
 
 @app.route("/admin_anonymize", methods=["POST"])
@@ -993,7 +1644,7 @@ def admin_review():
         recipients=[user_email[0]["email"]],
     )
     msg.body = f"Vámi přidaná recenze na stránkách Recenze-společností byla právě schválena administrátorem a byla přidána mezi ostatní recenze. tým Recenze-společností."
-    mail.send(msg)
+    outbox.enqueue(msg)
 
     flash(
         f"Recenze id: {review_id_to_delete} s textem {review_text} byla úspěšně přesunuta do tabulky reviews."
@@ -1033,7 +1684,7 @@ def admin_deleted():
         recipients=[user_email[0]["email"]],
     )
     msg.body = f"Vámi přidaná recenze na stránkách Recenze-společností byla administrátorem zamítnuta. Vaše recenze bohužel není v souladu s našimi uživatelskými podmínkami. Podmínky můžete nalézt na adrese: {'127.0.0.1:5000/terms_conditions'}. Tým Recenze-společností."
-    mail.send(msg)
+    outbox.enqueue(msg)
 
     # remove the review from temp_reviews
     db.execute("DELETE FROM temp_reviews WHERE id = ?", review_id_to_delete)
@@ -1074,7 +1725,7 @@ def admin_deleted_older():
         recipients=[user_email[0]["email"]],
     )
     msg.body = f"Vámi přidaná recenze na stránkách Recenze-společností byla administrátorem smazána. Vaše recenze bohužel není v souladu s našimi uživatelskými podmínkami. Podmínky můžete nalézt na adrese: {'127.0.0.1:5000/terms_conditions'}. Tým Recenze-společností."
-    mail.send(msg)
+    outbox.enqueue(msg)
 
     # remove the review from temp_reviews
     db.execute("DELETE FROM reviews WHERE id = ?", review_id_to_delete)
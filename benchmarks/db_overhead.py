@@ -0,0 +1,65 @@
+"""
+Per-query overhead of the database layer (database.py) compared to cs50's SQL, which the app used before.
+Both run the same statements against a copy of review.db. cs50 is skipped if it is not installed.
+Usage: python benchmarks/db_overhead.py [--repeat 2000]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import Database
+
+QUERIES = [
+    ("select by primary key", "SELECT * FROM users WHERE id = ?", (4,)),
+    ("select by unique index", "SELECT id FROM companies WHERE company_name = ?", ("company A",)),
+    (
+        "home feed join",
+        "SELECT reviews.id, reviews.review_text, reviews.rating, reviews.date_time, companies.company_name, companies.company_type, users.name FROM reviews JOIN companies ON reviews.company_id = companies.id JOIN users ON reviews.user_id = users.id ORDER BY reviews.date_time DESC, reviews.id DESC LIMIT ?",
+        (21,),
+    ),
+    ("update", "UPDATE users SET name = name WHERE id = ?", (4,)),
+]
+
+
+def measure(db, sql, args, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        db.execute(sql, *args)
+    return (time.perf_counter() - start) / repeat * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "review.db")
+    shutil.copy(os.path.join(ROOT, "review.db"), path)
+
+    layers = [("database.py", Database(path))]
+    try:
+        from cs50 import SQL
+        import logging
+
+        # cs50 logs every statement - not part of what is measured here
+        logging.getLogger("cs50").disabled = True
+        layers.append(("cs50.SQL", SQL(f"sqlite:///{path}")))
+    except ImportError:
+        print("cs50 is not installed - only database.py is measured")
+
+    print(f"{'query':<25}" + "".join(f"{name:>16}" for name, db in layers) + "   (µs per query)")
+    for label, sql, query_args in QUERIES:
+        results = [measure(db, sql, query_args, args.repeat) for name, db in layers]
+        print(f"{label:<25}" + "".join(f"{result:>16.1f}" for result in results))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
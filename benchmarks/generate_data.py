@@ -0,0 +1,168 @@
+"""
+Synthetic data for measuring the app at a realistic scale.
+Copies review.db, applies the migrations and fills it with companies of the types in company_types.csv spread over the 14 regions, users, approved reviews and reviews waiting for approval.
+Review texts are put together from Czech phrases matching the rating. Recent reviews are more common than old ones and a few popular companies and active users get most of them.
+Every generated user has the email user<n>@example.cz and the password "benchmark".
+Usage: python benchmarks/generate_data.py out.db [--reviews 100000] [--companies N] [--users N] [--pending N] [--seed 1]
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations
+from collation import czech_key
+from company_names import fold, word_starts
+from database import Database
+from reference_data import REGIONS, read_company_types
+
+PASSWORD = "benchmark"
+
+CITIES = ["Praha", "Brno", "Ostrava", "Plzeň", "Liberec", "Olomouc", "České Budějovice", "Hradec Králové", "Ústí nad Labem", "Pardubice", "Zlín", "Jihlava", "Karlovy Vary", "Kladno"]
+
+FIRST_NAMES = ["Jan", "Petr", "Pavel", "Tomáš", "Jiří", "Martin", "Lukáš", "Jakub", "Ondřej", "Michal", "Jana", "Eva", "Hana", "Lenka", "Kateřina", "Lucie", "Petra", "Tereza", "Veronika", "Zuzana"]
+SURNAMES = ["Novák", "Svoboda", "Novotný", "Dvořák", "Černý", "Procházka", "Kučera", "Veselý", "Horák", "Němec", "Pokorný", "Marek", "Pospíšil", "Hájek", "Jelínek", "Král", "Růžička", "Beneš", "Fiala", "Sedláček", "Doležal", "Zeman", "Kolář", "Navrátil", "Čermák", "Urban", "Vaněk", "Blažek", "Kříž", "Kovář"]
+
+NAME_WORDS = ["Alfa", "Beta", "Delta", "Nova", "Sever", "Jih", "Morava", "Bohemia", "Vltava", "Labe", "Šumava", "Krkonoše", "Praktik", "Servis", "Stav", "Tech", "Trans", "Agro", "Elektro", "Kovo", "Dřevo", "Plast", "Auto", "Moto", "Bio", "Eko", "Řemeslo", "Žula", "Čerpadla", "Účetnictví"]
+LEGAL_FORMS = ["s.r.o.", "a.s.", "spol. s r.o.", "v.o.s.", "k.s.", ""]
+
+OPENINGS = ["Firmu jsem využil na doporučení známých.", "Spolupracujeme s nimi už několik let.", "Objednávala jsem přes jejich web.", "Byl jsem tu poprvé.", "Zakázku jsme zadali na jaře.", "Přišli jsme na základě recenzí."]
+POSITIVE = ["Komunikace byla rychlá a věcná.", "Termíny dodrželi přesně.", "Cena odpovídala kvalitě.", "Personál byl ochotný a příjemný.", "Práce byla odvedena pečlivě.", "Vše proběhlo bez problémů.", "Určitě se vrátím.", "Mohu jen doporučit."]
+NEUTRAL = ["Výsledek byl v pořádku, ale nic extra.", "Komunikace občas vázla.", "Cena byla trochu vyšší, než jsem čekal.", "Termín se o pár dní posunul.", "Kvalita byla průměrná."]
+NEGATIVE = ["Na odpověď jsem čekal přes dva týdny.", "Termín nedodrželi a neomluvili se.", "Kvalita práce byla špatná.", "Reklamaci odmítli vyřídit.", "Personál byl nepříjemný.", "Nedoporučuji.", "Fakturovali víc, než bylo domluveno."]
+
+# how often each rating is given, 1 to 5
+RATING_WEIGHTS = [10, 7, 13, 30, 40]
+
+
+def skewed_weights(count, exponent):
+    """Cumulative weights of a Zipf-like distribution - the first items are picked far more often than the last ones"""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def company_names(rng, count):
+    names = set()
+    while len(names) < count:
+        name = f"{rng.choice(NAME_WORDS)}{rng.choice(['', ' ', '-'])}{rng.choice(NAME_WORDS + SURNAMES)} {rng.choice(LEGAL_FORMS)}".strip()
+        # once the combinations run out a number keeps the names unique
+        if name in names:
+            name = f"{name} {len(names)}"
+        names.add(name)
+    return sorted(names, key=lambda name: rng.random())
+
+
+def review_text(rng, rating):
+    if rating >= 4:
+        phrases = POSITIVE
+    elif rating == 3:
+        phrases = NEUTRAL + POSITIVE[:3]
+    else:
+        phrases = NEGATIVE
+    sentences = [rng.choice(OPENINGS)] + rng.sample(phrases, rng.randint(1, 4))
+    return " ".join(sentences)[:1000]
+
+
+def review_date(rng, now, days):
+    # squaring the random number makes recent dates more common than old ones
+    age = datetime.timedelta(days=days * rng.random() ** 2, seconds=rng.randrange(86400))
+    return (now - age).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def generate(path, reviews, companies=None, users=None, pending=None, seed=1, days=3 * 365, rounds=12, log=print):
+    """Create the database at path. Returns the numbers of rows generated."""
+    companies = companies or max(100, reviews // 20)
+    users = users or max(100, reviews // 5)
+    pending = reviews // 100 if pending is None else pending
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+
+    shutil.copy(os.path.join(ROOT, "review.db"), path)
+    migrations.migrate(Database(path))
+
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("BEGIN")
+    start = time.perf_counter()
+
+    types = read_company_types(os.path.join(ROOT, "company_types.csv"))
+    first_company = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM companies").fetchone()[0]
+    names = company_names(rng, companies)
+    connection.executemany(
+        "INSERT INTO companies (id, company_name, company_type, company_location, company_web, company_adress, sort_key, name_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (first_company + number, name, rng.choice(types), rng.choice(REGIONS), f"https://www.firma{first_company + number}.cz", f"{rng.choice(SURNAMES)}ova {rng.randint(1, 200)}, {rng.choice(CITIES)}", czech_key(name), fold(name))
+            for number, name in enumerate(names)
+        ),
+    )
+    # the parts of the names starting at their further words, for the suggestions - as add_company() stores them
+    connection.executemany(
+        "INSERT OR IGNORE INTO company_words (word, company_id) VALUES (?, ?)",
+        ((word, first_company + number) for number, name in enumerate(names) for word in word_starts(fold(name))),
+    )
+    log(f"{companies} companies")
+
+    # bcrypt is slow on purpose - all users share one hash of the same password
+    pw_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+    first_user = connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM users").fetchone()[0]
+    connection.executemany(
+        "INSERT INTO users (id, email, name, hash, role) VALUES (?, ?, ?, ?, 'user')",
+        (
+            (first_user + number, f"user{number}@example.cz", f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}", pw_hash)
+            for number in range(users)
+        ),
+    )
+    log(f"{users} users")
+
+    company_weights = skewed_weights(companies, 0.8)
+    user_weights = skewed_weights(users, 0.6)
+
+    def rows(count, days):
+        batch = 10000
+        for done in range(0, count, batch):
+            size = min(batch, count - done)
+            company_ids = rng.choices(range(first_company, first_company + companies), cum_weights=company_weights, k=size)
+            user_ids = rng.choices(range(first_user, first_user + users), cum_weights=user_weights, k=size)
+            ratings = rng.choices(range(1, 6), weights=RATING_WEIGHTS, k=size)
+            for company_id, user_id, rating in zip(company_ids, user_ids, ratings):
+                yield review_text(rng, rating), rating, company_id, user_id, review_date(rng, now, days)
+
+    # triggers keep the aggregates and the full text index up to date, as they would in the app
+    connection.executemany("INSERT INTO reviews (review_text, rating, company_id, user_id, date_time) VALUES (?, ?, ?, ?, ?)", rows(reviews, days))
+    log(f"{reviews} reviews")
+    # reviews waiting for approval are all from the last few days
+    connection.executemany("INSERT INTO temp_reviews (review_text, rating, company_id, user_id, date_time) VALUES (?, ?, ?, ?, ?)", rows(pending, 7))
+    log(f"{pending} reviews waiting for approval")
+
+    connection.execute("COMMIT")
+    connection.execute("ANALYZE")
+    # the database is in WAL mode - move everything into the main file, so that it can be copied on its own
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+    log(f"generated in {time.perf_counter() - start:.1f} s")
+    return {"companies": companies, "users": users, "reviews": reviews, "pending": pending}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="database file to create")
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--companies", type=int, help="default: one per 20 reviews")
+    parser.add_argument("--users", type=int, help="default: one per 5 reviews")
+    parser.add_argument("--pending", type=int, help="reviews waiting for approval, default: 1 %% of reviews")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt work factor of the users' password")
+    args = parser.parse_args()
+    generate(args.path, args.reviews, args.companies, args.users, args.pending, args.seed, rounds=args.rounds)
+
+
+if __name__ == "__main__":
+    main()
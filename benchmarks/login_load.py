@@ -0,0 +1,88 @@
+"""
+Login latency under concurrent load.
+Runs the app on a copy of review.db with the Flask test client. Several threads keep logging in while others load a public page, and the p50/p99 latencies of both are reported.
+Usage: python benchmarks/login_load.py [--threads 16] [--requests 20] [--rounds 12]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16, help="threads logging in")
+    parser.add_argument("--requests", type=int, default=20, help="logins per thread")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt work factor")
+    args = parser.parse_args()
+
+    # the app works with review.db in the current directory - use a copy and keep emails in the outbox
+    workdir = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "review.db"), workdir)
+    os.chdir(workdir)
+    os.environ["OUTBOX_WORKER"] = "0"
+    os.environ["BCRYPT_LOG_ROUNDS"] = str(args.rounds)
+    sys.path.insert(0, ROOT)
+    import app as application
+
+    app = application.app
+    email = "benchmark@example.com"
+    application.db.execute("DELETE FROM users WHERE email = ?", email)
+    application.db.execute(
+        "INSERT INTO users (email, name, hash, role) VALUES (?, 'benchmark', ?, 'user')",
+        email,
+        application.bcrypt.generate_password_hash("benchmark"),
+    )
+
+    login_times = []
+    page_times = []
+    rejected = []
+    done = threading.Event()
+
+    def login():
+        client = app.test_client()
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.post("/login", data={"email": email, "password": "benchmark"})
+            login_times.append(time.perf_counter() - start)
+            if response.status_code == 503:
+                rejected.append(1)
+
+    def browse():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get("/privacy_policy")
+            page_times.append(time.perf_counter() - start)
+
+    browsers = [threading.Thread(target=browse) for _ in range(4)]
+    logins = [threading.Thread(target=login) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in browsers + logins:
+        thread.start()
+    for thread in logins:
+        thread.join()
+    done.set()
+    for thread in browsers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"hashing workers: {application.bcrypt.workers}, work factor: {args.rounds}")
+    print(f"logins: {len(login_times)} in {elapsed:.2f} s, rejected with 503: {len(rejected)}")
+    print(f"login   p50 {percentile(login_times, 0.5) * 1000:8.1f} ms   p99 {percentile(login_times, 0.99) * 1000:8.1f} ms")
+    print(f"page    p50 {percentile(page_times, 0.5) * 1000:8.1f} ms   p99 {percentile(page_times, 0.99) * 1000:8.1f} ms")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
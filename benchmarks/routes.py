@@ -0,0 +1,228 @@
+"""
+Latency and throughput of the main routes at several sizes of the database.
+For every size a database is generated with generate_data.py (and kept in benchmarks/data for the next run). A separate process then runs the app on a copy of it with the Flask test client.
+Emails stay in the outbox and DNS lookups are stubbed out, so nothing leaves the machine.
+The results are stored as json (by default benchmarks/results/<commit>.json). --compare prints the change against an earlier result file.
+Usage: python benchmarks/routes.py [--reviews 10000 100000 1000000] [--requests 100] [--rounds 12] [--compare old.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ROUTES = [
+    "GET /",
+    "GET /reviews",
+    "POST /reviews",
+    "GET /account",
+    "GET /admin_index",
+    "POST /add_review",
+    "POST /login",
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_routes(path, requests, rounds, seed):
+    """Measure every route on a copy of the database at path. Runs in its own process, because the app opens review.db when it is imported."""
+    workdir = tempfile.mkdtemp()
+    shutil.copy(path, os.path.join(workdir, "review.db"))
+    os.chdir(workdir)
+    os.environ["OUTBOX_WORKER"] = "0"
+    # the benchmark logs in and posts reviews far faster than any real user
+    os.environ["RATE_LIMIT"] = "0"
+    os.environ["EMAIL_DELIVERABILITY"] = "deferred"
+    os.environ["EMAIL_CHECK_WORKER"] = "0"
+    os.environ["BCRYPT_LOG_ROUNDS"] = str(rounds)
+    sys.path.insert(0, ROOT)
+    import app as application
+
+    app = application.app
+    app.config["MAIL_SUPPRESS_SEND"] = True
+    application.email_checker.deliverable = lambda domain: True
+    db = application.db
+    rng = random.Random(seed)
+
+    users = db.execute("SELECT id, email FROM users WHERE role = 'user' AND email LIKE 'user%@example.cz'")
+    admin = db.execute("SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1")[0]["id"]
+    companies = [row["company_name"] for row in db.execute("SELECT company_name FROM companies")]
+    client = app.test_client()
+
+    def log_in(user_id, role):
+        with client.session_transaction() as session:
+            session.clear()
+            session["user_id"] = user_id
+            session["role"] = role
+
+    def log_out():
+        with client.session_transaction() as session:
+            session.clear()
+
+    def prepare(route):
+        """Set up the session for one request and return the arguments of the request"""
+        user = rng.choice(users)
+        if route == "GET /":
+            log_out()
+            return "GET", "/", None
+        if route == "GET /reviews":
+            log_out()
+            return "GET", "/reviews", None
+        if route == "POST /reviews":
+            log_out()
+            return "POST", "/reviews", {"company_name": rng.choice(companies)}
+        if route == "GET /account":
+            log_in(user["id"], "user")
+            return "GET", "/account", None
+        if route == "GET /admin_index":
+            log_in(admin, "admin")
+            return "GET", "/admin_index", None
+        if route == "POST /add_review":
+            log_in(user["id"], "user")
+            return "POST", "/add_review", {
+                "company_name": rng.choice(companies),
+                "company_rating": str(rng.randint(1, 5)),
+                "company_review": "Služby byly v pořádku, termín dodrželi.",
+            }
+        if route == "POST /login":
+            log_out()
+            return "POST", "/login", {"email": user["email"], "password": "benchmark"}
+        raise ValueError(route)
+
+    results = {}
+    for route in ROUTES:
+        # a few requests first, so that caches and the hashing pool are warmed up
+        for _ in range(min(5, requests)):
+            method, url, data = prepare(route)
+            client.open(url, method=method, data=data)
+        times = []
+        statuses = {}
+        for _ in range(requests):
+            method, url, data = prepare(route)
+            start = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            response.get_data()
+            times.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        results[route] = {
+            "requests": requests,
+            "throughput": requests / sum(times),
+            "mean_ms": sum(times) / requests * 1000,
+            "p50_ms": percentile(times, 0.5) * 1000,
+            "p95_ms": percentile(times, 0.95) * 1000,
+            "p99_ms": percentile(times, 0.99) * 1000,
+            "statuses": statuses,
+        }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(old, new):
+    """Print the change of the latencies against an earlier result"""
+    old_runs = {run["reviews"]: run for run in old["runs"]}
+    print(f"compared with {old.get('commit')} from {old.get('date')}")
+    for run in new["runs"]:
+        previous = old_runs.get(run["reviews"])
+        if not previous:
+            continue
+        for route, result in run["routes"].items():
+            before = previous["routes"].get(route)
+            if not before:
+                continue
+            changes = "  ".join(
+                f"{key[:3]} {before[key]:8.2f} -> {result[key]:8.2f} ms ({(result[key] / before[key] - 1) * 100 if before[key] else 0:+5.0f} %)"
+                for key in ("p50_ms", "p95_ms", "p99_ms")
+            )
+            print(f"{run['reviews']:>8} {route:<18} {changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reviews", type=int, nargs="+", default=[10000, 100000, 1000000], help="sizes of the database")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt work factor")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default=os.path.join(HERE, "data"), help="where the generated databases are kept")
+    parser.add_argument("--output", help="result file, default: benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    # internal - measure one database in this process and print the results
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_routes(args.run, args.requests, args.rounds, args.seed)))
+        return
+
+    sys.path.insert(0, HERE)
+    import generate_data
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    result = {
+        "commit": commit(),
+        "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "requests": args.requests,
+        "rounds": args.rounds,
+        "runs": [],
+    }
+    for size in args.reviews:
+        path = os.path.join(args.data_dir, f"reviews-{size}-seed{args.seed}-rounds{args.rounds}.db")
+        if not os.path.exists(path):
+            print(f"generating {path}")
+            generate_data.generate(path, size, seed=args.seed, rounds=args.rounds)
+        with sqlite3.connect(path) as connection:
+            counts = {
+                table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("companies", "users", "reviews", "temp_reviews")
+            }
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", path, "--requests", str(args.requests), "--rounds", str(args.rounds), "--seed", str(args.seed)],
+            capture_output=True,
+            text=True,
+        )
+        if output.returncode != 0:
+            sys.exit(output.stderr)
+        routes = json.loads(output.stdout.strip().splitlines()[-1])
+        result["runs"].append({"reviews": size, "counts": counts, "routes": routes})
+        print(f"{size} reviews")
+        for route, measured in routes.items():
+            print(
+                f"  {route:<18} {measured['throughput']:8.1f} req/s   p50 {measured['p50_ms']:8.2f} ms   p95 {measured['p95_ms']:8.2f} ms   p99 {measured['p99_ms']:8.2f} ms   {measured['statuses']}"
+            )
+
+    output_path = args.output or os.path.join(HERE, "results", f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(result, file, indent=2)
+    print(f"results stored in {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            compare(json.load(file), result)
+
+
+if __name__ == "__main__":
+    main()
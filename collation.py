@@ -0,0 +1,91 @@
+"""
+Czech alphabetical order without depending on the locales installed on the server.
+The order follows the Czech standard (ČSN 97 6030) in a simplified form:
+- č, ř, š, ž are letters of their own, sorted after c, r, s, z, and "ch" is a letter of its own between h and i
+- other diacritics (á, é, ě, í, ó, ú, ů, ý, ď, ť, ň, ...) only decide between words that are the same otherwise - "pan" < "pán" < "pana"
+- lowercase comes before uppercase only when the words are the same otherwise
+- spaces come before punctuation, punctuation before digits and digits before letters
+"""
+import unicodedata
+
+# letters of the Czech alphabet in order. Letters of other latin alphabets are sorted as their base letter (e.g. "ä" as "a")
+ALPHABET = ["a", "b", "c", "č", "d", "e", "f", "g", "h", "ch", "i", "j", "k", "l", "m", "n", "o", "p", "q", "r", "ř", "s", "š", "t", "u", "v", "w", "x", "y", "z", "ž"]
+
+# weights are stored as characters. Everything used by the first level is below 0x100, so any other script sorts after the latin letters
+_SPACE = 1
+_PUNCTUATION = 2
+_DIGIT = 3
+_LETTER = _DIGIT + 10
+_WEIGHTS = {letter: _LETTER + number for number, letter in enumerate(ALPHABET)}
+_BASE = 0x20
+# separates the levels of the key - lower than any weight, so a shorter word comes before a longer one with the same beginning
+_SEPARATOR = "\x01"
+
+# order of the diacritics at the second level
+_MARKS = {
+    "\u0301": 1,  # acute - á, é, í, ó, ú, ý
+    "\u030a": 2,  # ring - ů
+    "\u030c": 3,  # caron - ď, ě, ň, ť
+}
+
+
+def _units(text):
+    """Split a text into (letter without diacritics, diacritic weight, uppercase) units, "ch" being one unit"""
+    units = []
+    text = unicodedata.normalize("NFC", text)
+    position = 0
+    while position < len(text):
+        char = text[position]
+        lower = char.lower()
+        if lower == "c" and text[position + 1 : position + 2].lower() == "h":
+            units.append(("ch", 0, char.isupper()))
+            position += 2
+            continue
+        position += 1
+        if lower in _WEIGHTS:
+            units.append((lower, 0, char.isupper()))
+            continue
+        decomposed = unicodedata.normalize("NFD", lower)
+        base, marks = decomposed[0], decomposed[1:]
+        # č, ř, š, ž are letters of their own
+        if base + marks in _WEIGHTS:
+            units.append((base + marks, 0, char.isupper()))
+            continue
+        mark = sum(_MARKS.get(mark, 4) for mark in marks)
+        units.append((base, mark, char.isupper()))
+    return units
+
+
+def _primary(letter):
+    weight = _WEIGHTS.get(letter)
+    if weight is not None:
+        return chr(_BASE + weight)
+    if letter in "0123456789":
+        return chr(_BASE + _DIGIT + int(letter))
+    if letter.isspace():
+        return chr(_BASE + _SPACE)
+    if ord(letter) >= 0x100:
+        return letter
+    # latin letters that are not made of a base letter and a diacritic, like "ß" or "ø", come after "ž"
+    if letter.isalpha():
+        return chr(_BASE + _LETTER + len(ALPHABET))
+    return chr(_BASE + _PUNCTUATION)
+
+
+def czech_key(text):
+    """
+    Key of a text for sorting in Czech order - compare keys instead of the texts, e.g. sorted(names, key=czech_key).
+    The key is a string that compares correctly as plain text, so it can also be stored in the database and sorted by with ORDER BY.
+    """
+    units = _units(text or "")
+    primary = "".join(_primary(letter) for letter, mark, upper in units)
+    secondary = "".join(chr(_BASE + mark) for letter, mark, upper in units)
+    tertiary = "".join(chr(_BASE + upper) for letter, mark, upper in units)
+    # the text itself decides between texts that differ only in punctuation, so the order is always the same
+    return _SEPARATOR.join([primary, secondary, tertiary, text or ""])
+
+
+def czech_compare(a, b):
+    """Comparison function for sqlite3's create_collation"""
+    a, b = czech_key(a), czech_key(b)
+    return (a > b) - (a < b)
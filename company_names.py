@@ -0,0 +1,119 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+
+def fold(text):
+    """Case and diacritics insensitive form of a text for searching, e.g. "Čerpadla" -> "cerpadla" """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def slug(name):
+    """Name of a company for urls, e.g. "Čerpadla Žďár s.r.o." -> "cerpadla-zdar-s-r-o" """
+    return re.sub(r"[^a-z0-9]+", "-", fold(name)).strip("-") or "firma"
+
+
+def word_starts(key):
+    """The parts of a folded name starting at each of its words except the first one, e.g. "stavby a.s." -> ["a.s."]"""
+    return [
+        key[i:]
+        for i in range(1, len(key))
+        if key[i].isalnum() and not key[i - 1].isalnum()
+    ]
+
+
+def prefix_range(text):
+    """Bounds of the folded names starting with the text, for "key >= low AND key < high" in SQL. None if the text has nothing to search for"""
+    low = fold(text)
+    if not low:
+        return None
+    return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+
+class SearchData:
+    """
+    Search structures over the folded company names (see fold()). They are never changed once built, a new instance replaces the old one instead.
+    - keys, ids: folded names sorted alphabetically and the ids of their companies
+    - joined, offsets: all folded names joined by newlines and the position where each of them starts - for substring search with str.find()
+    """
+
+    def __init__(self, companies):
+        """companies is a list of (folded name, company id) pairs sorted by the name"""
+        self.keys = [key for key, company_id in companies]
+        self.ids = [company_id for key, company_id in companies]
+        self.joined = "\n".join(self.keys)
+        self.offsets = []
+        position = 0
+        for key in self.keys:
+            self.offsets.append(position)
+            position += len(key) + 1
+
+
+class CompanyNameIndex:
+    """
+    All company names kept in memory and shared by every request of this process, so that searching them never has to look at every company in Python.
+    Companies can be added by other workers as well. The 'companies' counter in the data_versions table is bumped by a trigger on every change, so a differing counter means the index has to be reloaded.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.version = None
+        self.name_set = set()
+        self.search = SearchData([])
+
+    def _db_version(self):
+        rows = self.db.execute("SELECT version FROM data_versions WHERE name = 'companies'")
+        if not rows:
+            return 0
+        return rows[0]["version"]
+
+    def _refresh(self):
+        """Reload the names if the companies table changed since they were loaded"""
+        # the version is read before the names - a company added in between only causes one more reload later
+        version = self._db_version()
+        if version == self.version:
+            return
+        rows = self.db.rows("SELECT id, company_name FROM companies")
+        companies = sorted((fold(row["company_name"]), row["id"]) for row in rows)
+        with self.lock:
+            self.search = SearchData(companies)
+            self.name_set = set(row["company_name"] for row in rows)
+            self.version = version
+
+    def __contains__(self, name):
+        self._refresh()
+        return name in self.name_set
+
+    def add(self, company_id, name):
+        """Put a company inserted by this process into the index without reloading it"""
+        version = self._db_version()
+        with self.lock:
+            # only our own insert happened since the last load - otherwise let the next access reload everything
+            if self.version is None or version != self.version + 1 or name in self.name_set:
+                return
+            companies = list(zip(self.search.keys, self.search.ids))
+            bisect.insort(companies, (fold(name), company_id))
+            self.search = SearchData(companies)
+            self.name_set.add(name)
+            self.version = version
+
+    def substring_ids(self, text, limit=None):
+        """Ids of companies whose name contains the text anywhere"""
+        self._refresh()
+        key = fold(text)
+        if not key or "\n" in key:
+            return []
+        search = self.search
+        found = []
+        position = search.joined.find(key)
+        while position != -1:
+            # the name the match lies in - continue searching after its end so that every company is found once
+            entry = bisect.bisect_right(search.offsets, position) - 1
+            found.append(search.ids[entry])
+            if limit and len(found) >= limit:
+                break
+            position = search.joined.find(key, search.offsets[entry] + len(search.keys[entry]) + 1)
+        return found
@@ -0,0 +1,179 @@
+import contextlib
+import datetime
+import functools
+import sqlite3
+import threading
+import time
+from collation import czech_compare
+
+
+@functools.lru_cache(maxsize=1024)
+def _placeholders(sql):
+    """Positions of the ? placeholders in a statement, not counting question marks inside quotes"""
+    positions = []
+    quote = None
+    for position, char in enumerate(sql):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"`[":
+            quote = "]" if char == "[" else char
+        elif char == "?":
+            positions.append(position)
+    return tuple(positions)
+
+
+def _expand_lists(sql, args):
+    """Turn each list or tuple argument into as many placeholders as it has items, e.g. "WHERE id IN (?)" with [1, 2] -> "WHERE id IN (?, ?)" """
+    positions = _placeholders(sql)
+    parts = []
+    values = []
+    last = 0
+    for position, arg in zip(positions, args):
+        if isinstance(arg, (list, tuple)):
+            parts.append(sql[last:position])
+            # an empty list matches nothing
+            parts.append(", ".join("?" * len(arg)) if arg else "NULL")
+            values.extend(arg)
+            last = position + 1
+        else:
+            values.append(arg)
+    parts.append(sql[last:])
+    return "".join(parts), values
+
+
+def _adapt(value):
+    # dates are stored as text in the same format cs50's SQL used, e.g. "2024-08-19 08:39:10"
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, datetime.time):
+        return value.strftime("%H:%M:%S")
+    return value
+
+
+class Database:
+    """
+    Thin layer over sqlite3 used in place of cs50's SQL.
+    Every thread (or worker process) keeps one open connection in WAL mode, so that readers do not wait for a writer, with a larger page cache, memory mapped reads and a cache of prepared statements.
+    execute() behaves like cs50's SQL.execute(): SELECT returns a list of dicts, INSERT the id of the new row, UPDATE and DELETE the number of rows changed, and a violated constraint raises ValueError.
+    rows() is a faster path for reading that returns sqlite3.Row objects (usable both as tuples and by column name).
+    Statements run in autocommit mode unless they are inside "with db.transaction():".
+    If on_query is set, it is called after every statement with the statement, its arguments and the seconds it took (see query_stats.py).
+    """
+
+    def __init__(self, path, cache_size=20000, mmap_size=256 * 1024 * 1024, cached_statements=256, busy_timeout=5000):
+        self.path = path
+        # page cache per connection in KiB
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.on_query = None
+
+    def connection(self):
+        """The connection of the current thread"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+            )
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute(f"PRAGMA cache_size = -{int(self.cache_size)}")
+            connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+            connection.execute("PRAGMA temp_store = MEMORY")
+            # cs50's SQL turned foreign keys on as well
+            connection.execute("PRAGMA foreign_keys = ON")
+            # Czech alphabetical order for "ORDER BY ... COLLATE CZECH" - see collation.py
+            connection.create_collation("CZECH", czech_compare)
+            self.local.connection = connection
+            self.local.depth = 0
+        return connection
+
+    def _cursor(self, sql, args):
+        if any(isinstance(arg, (list, tuple)) for arg in args):
+            sql, args = _expand_lists(sql, args)
+        args = [_adapt(arg) for arg in args]
+        try:
+            return self.connection().execute(sql, args)
+        except sqlite3.IntegrityError as error:
+            raise ValueError(str(error)) from None
+        except (sqlite3.OperationalError, sqlite3.ProgrammingError) as error:
+            raise RuntimeError(str(error)) from None
+
+    def _result(self, sql, cursor):
+        if cursor.description is not None:
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        command = sql.lstrip().split(None, 1)[0].upper()
+        if command in ("INSERT", "REPLACE"):
+            return cursor.lastrowid if cursor.rowcount == 1 else None
+        if command in ("UPDATE", "DELETE"):
+            return cursor.rowcount
+        return True
+
+    def execute(self, sql, *args):
+        """Execute one statement, with the results in the same form as cs50's SQL.execute()"""
+        if self.on_query is None:
+            return self._result(sql, self._cursor(sql, args))
+        start = time.perf_counter()
+        try:
+            return self._result(sql, self._cursor(sql, args))
+        finally:
+            self.on_query(sql, args, time.perf_counter() - start)
+
+    def rows(self, sql, *args):
+        """Execute a query and return its rows as sqlite3.Row objects, without building a dict for every row"""
+        start = time.perf_counter()
+        try:
+            cursor = self._cursor(sql, args)
+            cursor.row_factory = sqlite3.Row
+            return cursor.fetchall()
+        finally:
+            if self.on_query is not None:
+                self.on_query(sql, args, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the statements inside the with block as one transaction - committed at the end, rolled back on an exception.
+        Nested transaction() blocks become part of the outermost one.
+        """
+        connection = self.connection()
+        if self.local.depth:
+            self.local.depth += 1
+            try:
+                yield
+            finally:
+                self.local.depth -= 1
+            return
+        # IMMEDIATE takes the write lock right away, so the transaction can not fail half way because another one is writing
+        connection.execute("BEGIN IMMEDIATE")
+        self.local.depth = 1
+        self.local.after_commit = []
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+            for callback in self.local.after_commit:
+                callback()
+        finally:
+            self.local.depth = 0
+            self.local.after_commit = []
+
+    def after_commit(self, callback):
+        """Call callback once the current transaction is committed, or right away outside of a transaction. It is dropped if the transaction is rolled back."""
+        if getattr(self.local, "depth", 0):
+            self.local.after_commit.append(callback)
+        else:
+            callback()
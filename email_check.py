@@ -0,0 +1,142 @@
+import collections
+import threading
+import time
+from email_validator import validate_email, EmailUndeliverableError
+from email_validator.deliverability import validate_email_deliverability
+
+# domains of the most common providers - they are known to receive mail, so they are never looked up
+COMMON_DOMAINS = frozenset(
+    [
+        "seznam.cz",
+        "email.cz",
+        "post.cz",
+        "centrum.cz",
+        "atlas.cz",
+        "volny.cz",
+        "gmail.com",
+        "outlook.com",
+        "hotmail.com",
+        "icloud.com",
+        "yahoo.com",
+    ]
+)
+
+
+class EmailChecker:
+    """
+    Validation of email adresses with the DNS (MX) lookups of their domains cached.
+    Results are cached per domain in a LRU cache - deliverable domains for ttl seconds, undeliverable ones for negative_ttl seconds.
+    In the "inline" mode an unknown domain is looked up while the user waits, like validate_email(..., check_deliverability=True) does. If the DNS does not answer, the account is left 'pending' as in the deferred mode.
+    In the "deferred" mode only the syntax is checked while the user waits. The account is flagged with email_status 'pending' and verify_pending() looks the domain up later in the background.
+    """
+
+    def __init__(self, mode="inline", max_size=10000, ttl=86400, negative_ttl=3600, timeout=5):
+        self.mode = mode
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # domain -> (deliverable, expiry time)
+        self.cache = collections.OrderedDict()
+
+    def cached(self, domain):
+        """True or False if the deliverability of the domain is known, None otherwise"""
+        if domain in COMMON_DOMAINS:
+            return True
+        with self.lock:
+            entry = self.cache.get(domain)
+            if entry is None:
+                return None
+            deliverable, expires = entry
+            if expires < time.monotonic():
+                del self.cache[domain]
+                return None
+            self.cache.move_to_end(domain)
+            return deliverable
+
+    def _store(self, domain, deliverable):
+        ttl = self.ttl if deliverable else self.negative_ttl
+        with self.lock:
+            self.cache[domain] = (deliverable, time.monotonic() + ttl)
+            self.cache.move_to_end(domain)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def deliverable(self, domain):
+        """Whether the domain can receive mail, looked up in the DNS if it is not cached. None if the DNS did not answer."""
+        deliverable = self.cached(domain)
+        if deliverable is not None:
+            return deliverable
+        try:
+            info = validate_email_deliverability(domain, domain, timeout=self.timeout)
+        except EmailUndeliverableError:
+            self._store(domain, False)
+            return False
+        # a timeout or an unreachable DNS server says nothing about the domain - it is not cached
+        if "unknown-deliverability" in info:
+            return None
+        self._store(domain, True)
+        return True
+
+    def validate(self, address):
+        """
+        Validate an email adress. Raises EmailNotValidError if it is not valid.
+        Returns the normalized adress and the email_status for the users table - 'verified', or 'pending' if the domain is left for verify_pending().
+        """
+        emailinfo = validate_email(address, check_deliverability=False)
+        domain = emailinfo.ascii_domain
+        if self.mode == "deferred":
+            deliverable = self.cached(domain)
+        else:
+            deliverable = self.deliverable(domain)
+        if deliverable is False:
+            raise EmailUndeliverableError(f"The domain name {domain} does not accept email.")
+        # not known yet - in the deferred mode it is not looked up, in the inline mode the DNS did not answer
+        if deliverable is None:
+            return emailinfo.normalized, "pending"
+        return emailinfo.normalized, "verified"
+
+    def verify_pending(self, db, batch_size=100):
+        """Look up the domains of the accounts flagged 'pending' and flag them 'verified' or 'undeliverable'. Returns the number of accounts checked."""
+        checked = 0
+        last_id = 0
+        # read in batches by id, so that accounts the DNS did not answer for do not take the place of the ones after them
+        while True:
+            users = db.execute(
+                "SELECT id, email FROM users WHERE email_status = 'pending' AND id > ? ORDER BY id LIMIT ?",
+                last_id,
+                batch_size,
+            )
+            if not users:
+                break
+            last_id = users[-1]["id"]
+            for user in users:
+                domain = user["email"].rsplit("@", 1)[-1].lower()
+                deliverable = self.deliverable(domain)
+                # the DNS did not answer - try again next time
+                if deliverable is None:
+                    continue
+                db.execute(
+                    "UPDATE users SET email_status = ? WHERE id = ? AND email_status = 'pending'",
+                    "verified" if deliverable else "undeliverable",
+                    user["id"],
+                )
+                checked += 1
+        return checked
+
+    def run(self, app, db, interval=60):
+        """Keep verifying the pending accounts"""
+        while True:
+            try:
+                with app.app_context():
+                    self.verify_pending(db)
+            except Exception:
+                app.logger.exception("Verifying email adresses failed")
+            time.sleep(interval)
+
+    def start_worker(self, app, db, interval=60):
+        """Verify the pending accounts from a daemon thread of this process"""
+        thread = threading.Thread(target=self.run, args=(app, db, interval), name="email-check", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,98 @@
+import collections
+import threading
+import time
+from database import Database
+
+
+class MemoryBackend:
+    """Fragments kept in this process, at most max_bytes of them - the least recently used are dropped first"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.items = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and self.items:
+                self.size -= len(self.items.popitem(last=False)[1])
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class SQLiteBackend:
+    """
+    Fragments kept in a separate sqlite file, shared by all worker processes on the machine - a local stand-in for a key-value store.
+    At most max_entries are kept, the least recently used are dropped first.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.db = Database(path)
+        self.max_entries = max_entries
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL, used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS fragments_used ON fragments(used)")
+        self.writes = 0
+
+    def get(self, key):
+        rows = self.db.rows("SELECT value FROM fragments WHERE key = ?", key)
+        if not rows:
+            return None
+        self.db.execute("UPDATE fragments SET used = ? WHERE key = ?", time.time(), key)
+        return rows[0]["value"]
+
+    def set(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO fragments (key, value, used) VALUES (?, ?, ?)", key, value, time.time())
+        # trimming needs a count of the table, so it is done only every 100 writes
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.db.execute(
+                "DELETE FROM fragments WHERE key IN (SELECT key FROM fragments ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                self.max_entries,
+            )
+
+    def clear(self):
+        self.db.execute("DELETE FROM fragments")
+
+
+class FragmentCache:
+    """
+    Rendered parts of pages, kept under a key that includes the version of the data they show.
+    When the data changes the version changes as well, so an outdated fragment is never found - it is just left to be dropped by the backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        """The cached fragment under key, or the result of render() which is then stored"""
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = str(render())
+        self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "backend": type(self.backend).__name__}
@@ -1,14 +1,15 @@
 
 from functools import wraps
 from flask import redirect, render_template, session
+from markupsafe import Markup, escape
 
 # adapted from cs50's finance problem set
-def apology(message):
+def apology(message, code=200):
     """
     Error message for the user
     """
 
-    return render_template("apology.html", message=message)
+    return render_template("apology.html", message=message), code
 
 
 # used from CS50's finance problem set.
@@ -25,4 +26,45 @@ def login_required(f):
             return redirect("/login")
         return f(*args, **kwargs)
 
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+def admin_required(f):
+    """
+    Decorate routes to require the admin role. Use after login_required.
+    The role is remembered in the session when the user logs in.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("role") != "admin":
+            return apology("Nepovolený přístup")
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def fts_query(text):
+    """
+    Turn what the user typed into a full text query.
+    Every word is quoted so that characters with a special meaning in FTS5 (like "-", ":" or "*") are searched for literally, and is matched as a prefix because Czech words change their endings.
+    """
+    words = []
+    for word in text.split():
+        word = word.replace('"', "")
+        # a word without letters or digits (like the "-" in "cena - kvalita") has no token to match and would make the whole query find nothing
+        if any(char.isalnum() for char in word):
+            words.append(f'"{word}"*')
+    return " ".join(words)
+
+
+# markers the snippet() function puts around the matched words. They can not appear in a review typed into a html form, so the rest of the text can be escaped safely
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+def highlight(snippet):
+    """Escape a snippet from the full text index and highlight the matched words"""
+    return Markup(
+        str(escape(snippet)).replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+    )
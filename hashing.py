@@ -0,0 +1,107 @@
+import atexit
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import bcrypt
+from concurrent.futures.process import BrokenProcessPool
+
+
+class HashingBusy(Exception):
+    """Too many passwords are waiting to be hashed - the request should be rejected right away"""
+
+
+# bcrypt only uses the first 72 bytes of a password. Newer versions of the library raise an error for longer ones instead of ignoring the rest, so the rest is cut off here the same way the existing hashes were made
+def _password_bytes(password):
+    return password.encode("utf-8")[:72]
+
+
+def _generate(password, rounds):
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(_password_bytes(password), pw_hash.encode("utf-8"))
+
+
+class PasswordHasher:
+    """
+    bcrypt hashing and checking of passwords in a pool of processes, so that a burst of logins does not occupy the threads serving other pages.
+    At most max_pending passwords may be waiting or being hashed at once. Above that HashingBusy is raised immediately instead of queueing more work.
+    rounds is the bcrypt work factor of new hashes. needs_rehash() tells whether an existing hash was made with a different one.
+    """
+
+    def __init__(self, rounds=12, workers=None, max_pending=None, timeout=10):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self.lock = threading.Lock()
+        self.pool = None
+        # whichever pool is current when the app exits is shut down - discarded pools were shut down already
+        atexit.register(self._shutdown)
+
+    def _executor(self):
+        # the pool is started on first use. spawn is used because forking a process that runs other threads (e.g. the outbox sender) is not safe
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.pool
+
+    def _shutdown(self):
+        with self.lock:
+            pool = self.pool
+        if pool is not None:
+            pool.shutdown()
+
+    def _discard(self, pool):
+        """Forget a pool whose worker died, so that the next call starts a new one"""
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, function, *args):
+        """Submit a job to the pool. Returns the future and the pool it runs in"""
+        # another thread may discard the pool between getting it and submitting to it. submit() then raises RuntimeError (BrokenProcessPool is one as well) and one more try is made with a new pool
+        for attempt in range(2):
+            pool = self._executor()
+            try:
+                return pool.submit(function, *args), pool
+            except RuntimeError:
+                self._discard(pool)
+        raise HashingBusy()
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future, pool = self._submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # the slot is given back when the job is done, not when we stop waiting - a job that timed out still occupies the pool
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            raise HashingBusy()
+        except BrokenProcessPool:
+            # a worker was killed (e.g. out of memory) - every job of the pool fails, so a new one is started
+            self._discard(pool)
+            raise HashingBusy()
+
+    def generate_password_hash(self, password):
+        return self._run(_generate, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Whether the hash was made with a different work factor than the current one. bcrypt hashes look like $2b$12$..."""
+        try:
+            return int(pw_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
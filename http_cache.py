@@ -0,0 +1,116 @@
+import functools
+import hashlib
+import os
+from flask import make_response, request, session
+
+
+class HttpCache:
+    """
+    Cache policies of the responses.
+    Public pages (decorated with public()) get an ETag and Last-Modified made from the data_versions counters they depend on, so browsers and proxies can ask "has it changed?" and get an empty 304 answer without the page being rendered again.
+    A page is only public for visitors who are not logged in and have no flashed message waiting - everyone else gets it rendered and not stored, like every other page.
+    Static files linked with url_for("static", ...) get the hash of their content in the url, so they can be cached for a year. A changed file gets a new url.
+    """
+
+    def __init__(self, app, db, static_max_age=365 * 24 * 3600):
+        self.app = app
+        self.db = db
+        self.static_max_age = static_max_age
+        # filename -> (modification time, hash of the content)
+        self.fingerprints = {}
+        # changes of the templates and the code change the pages as well - they are part of every ETag
+        self.release, self.release_time = self._release(app)
+        app.url_defaults(self._fingerprint_static)
+        app.after_request(self._static_headers)
+
+    def _release(self, app):
+        release = os.getenv("RELEASE")
+        files = []
+        for directory in (app.root_path, app.template_folder and os.path.join(app.root_path, app.template_folder)):
+            if directory and os.path.isdir(directory):
+                files += [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith((".py", ".html", ".csv"))]
+        digest = hashlib.sha1()
+        newest = 0
+        for entry in sorted(files, key=lambda entry: entry.path):
+            stat = entry.stat()
+            digest.update(f"{entry.path}:{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8"))
+            newest = max(newest, int(stat.st_mtime))
+        return release or digest.hexdigest()[:10], newest
+
+    def _fingerprint_static(self, endpoint, values):
+        if endpoint != "static" or "filename" not in values or "v" in values:
+            return
+        path = os.path.join(self.app.static_folder, values["filename"])
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        cached = self.fingerprints.get(values["filename"])
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as file:
+                cached = (mtime, hashlib.sha1(file.read()).hexdigest()[:10])
+            self.fingerprints[values["filename"]] = cached
+        values["v"] = cached[1]
+
+    def _static_headers(self, response):
+        if request.endpoint != "static":
+            return response
+        if request.args.get("v") and response.status_code == 200:
+            # the url changes with the content, so the file never has to be checked again
+            response.cache_control.public = True
+            response.cache_control.max_age = self.static_max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        else:
+            # linked without the hash - it may be cached but has to be revalidated
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+        return response
+
+    def versions(self, names):
+        """The version counters and the time of the last change of the named data"""
+        if not names:
+            return [], 0
+        rows = self.db.rows("SELECT name, version, changed FROM data_versions WHERE name IN (?) ORDER BY name", list(names))
+        return [f"{row['name']}{row['version']}" for row in rows], max(row["changed"] for row in rows)
+
+    def public(self, *names, max_age=0):
+        """
+        Decorate a route whose page (for GET) only depends on the named data_versions counters and on the url. Other methods are left alone.
+        max_age is how many seconds the page may be used without asking the server again.
+        """
+
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                # logged in users see their name and flashed messages in the layout - their pages are never shared
+                if request.method not in ("GET", "HEAD") or session.get("user_id") is not None or session.get("_flashes"):
+                    return f(*args, **kwargs)
+
+                versions, changed = self.versions(names)
+                etag = "-".join([self.release] + versions)
+                last_modified = max(changed, self.release_time)
+
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains_weak(etag)
+                else:
+                    not_modified = bool(request.if_modified_since) and request.if_modified_since.timestamp() >= last_modified
+                if not_modified:
+                    response = make_response("", 304)
+                else:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+                # the page looks different for logged in users and json is served for the same url
+                response.vary.add("Cookie")
+                response.vary.add("Accept")
+                return response
+
+            return decorated_function
+
+        return decorator
+
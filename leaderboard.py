@@ -0,0 +1,62 @@
+"""
+Rankings of the companies by a Bayesian average of their ratings, overall and within a type or a region.
+A company with few reviews is pulled towards the average rating of all reviews: its score is (weight * mean + points_total) / (weight + number_of_reviews),
+as if it had 'weight' more reviews of the average rating. A single 5 star review therefore does not beat hundreds of reviews averaging 4.8.
+The scores are stored in the leaderboard table (see migration 14) and kept up to date by triggers whenever the aggregates of a company change, using the prior stored in leaderboard_prior.
+The prior itself only moves slowly as reviews are added - refresh() computes it again and rebuilds the table ('flask refresh-leaderboards', e.g. once a day).
+"""
+
+# how many reviews of the average rating every company is assumed to have
+PRIOR_WEIGHT = 10
+
+# the rating assumed while there are no reviews at all
+DEFAULT_MEAN = 3.0
+
+# the leaderboard of the companies with at least one approved review, computed with the stored prior
+REBUILD = """
+INSERT INTO leaderboard (company_id, company_type, company_location, number_of_reviews, score)
+SELECT companies.id, companies.company_type, companies.company_location, companies.number_of_reviews,
+    (leaderboard_prior.weight * leaderboard_prior.mean + companies.points_total) / (leaderboard_prior.weight + companies.number_of_reviews)
+FROM companies, leaderboard_prior
+WHERE companies.number_of_reviews > 0
+"""
+
+
+def fill(db, weight=PRIOR_WEIGHT):
+    """Compute the prior from all approved reviews and rebuild the leaderboard with it. Has to run in a transaction"""
+    totals = db.execute("SELECT SUM(points_total) AS points, SUM(number_of_reviews) AS count FROM companies")[0]
+    mean = totals["points"] / totals["count"] if totals["count"] else DEFAULT_MEAN
+    db.execute("INSERT OR REPLACE INTO leaderboard_prior (id, mean, weight) VALUES (1, ?, ?)", mean, weight)
+    db.execute("DELETE FROM leaderboard")
+    db.execute(REBUILD)
+    # the scores of every company may have changed, so the cached pages showing them are outdated
+    db.execute(
+        "UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'leaderboard'"
+    )
+
+
+def refresh(db, weight=PRIOR_WEIGHT):
+    """Recompute the prior and all the scores. Returns the prior and the number of ranked companies"""
+    with db.transaction():
+        fill(db, weight)
+        prior = db.execute("SELECT mean, weight FROM leaderboard_prior WHERE id = 1")[0]
+        count = db.execute("SELECT COUNT(*) AS count FROM leaderboard")[0]["count"]
+    return prior, count
+
+
+def top(db, limit, company_type=None, company_location=None):
+    """The best ranked companies of the type and/or region (None for any), read from the leaderboard indexes in order"""
+    conditions = []
+    args = []
+    if company_type:
+        conditions.append("leaderboard.company_type = ?")
+        args.append(company_type)
+    if company_location:
+        conditions.append("leaderboard.company_location = ?")
+        args.append(company_location)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return db.execute(
+        f"SELECT companies.id, companies.company_name, companies.company_type, companies.company_location, companies.current_score, companies.number_of_reviews, leaderboard.score FROM leaderboard JOIN companies ON leaderboard.company_id = companies.id {where} ORDER BY leaderboard.score DESC, leaderboard.company_id DESC LIMIT ?",
+        *args,
+        limit,
+    )
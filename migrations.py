@@ -0,0 +1,335 @@
+"""
+Versioned changes of the database schema.
+Each migration is applied once, in order, in its own transaction, and recorded in the schema_migrations table.
+They are applied when the app starts (unless MIGRATE_ON_STARTUP=0) or with 'flask db-upgrade'.
+Migrations may meet a database that already has some of their objects - e.g. one where they were created by hand - so they only use CREATE ... IF NOT EXISTS, add_column() and statements that can safely run twice.
+New migrations are appended to MIGRATIONS. An applied migration must never be changed.
+"""
+import datetime
+import sqlite3
+from collation import czech_key
+from company_names import fold, word_starts
+
+
+def add_column(table, column, definition):
+    """Migration step adding a column to a table unless it already has it"""
+
+    def step(db):
+        columns = set(row["name"] for row in db.execute("SELECT name FROM pragma_table_info(?)", table))
+        if column not in columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    return step
+
+
+def fill_sort_keys(db):
+    """Migration step computing the sort_key of the companies that do not have it"""
+    for company in db.rows("SELECT id, company_name FROM companies WHERE sort_key IS NULL"):
+        db.execute("UPDATE companies SET sort_key = ? WHERE id = ?", czech_key(company["company_name"]), company["id"])
+
+
+
+def fill_name_keys(db):
+    """Migration step computing the folded names of the companies that do not have them, with the parts starting at their further words"""
+    for company in db.rows("SELECT id, company_name FROM companies WHERE name_key IS NULL"):
+        key = fold(company["company_name"])
+        db.execute("UPDATE companies SET name_key = ? WHERE id = ?", key, company["id"])
+        for word in word_starts(key):
+            db.execute("INSERT OR IGNORE INTO company_words (word, company_id) VALUES (?, ?)", word, company["id"])
+
+
+# RECOMPUTE as it was when migration 6 was written - the current one also counts the stars, whose columns only exist since migration 13
+RECOMPUTE_SCORES = """
+UPDATE companies SET number_of_reviews = totals.count, points_total = totals.total,
+    current_score = CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END
+FROM (SELECT companies.id AS company_id, COUNT(reviews.id) AS count, COALESCE(SUM(reviews.rating), 0) AS total
+    FROM companies LEFT JOIN reviews ON reviews.company_id = companies.id GROUP BY companies.id) AS totals
+WHERE companies.id = totals.company_id
+    AND (companies.number_of_reviews != totals.count OR companies.points_total != totals.total
+    OR abs(companies.current_score - CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END) > 1e-9)
+"""
+
+
+# RECOMPUTE as it was when migration 13 was written - including the counts of the stars
+RECOMPUTE_STARS = """
+UPDATE companies SET number_of_reviews = totals.count, points_total = totals.total,
+    current_score = CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END,
+    stars_1 = totals.stars_1, stars_2 = totals.stars_2, stars_3 = totals.stars_3, stars_4 = totals.stars_4, stars_5 = totals.stars_5
+FROM (SELECT companies.id AS company_id, COUNT(reviews.id) AS count, COALESCE(SUM(reviews.rating), 0) AS total,
+        COALESCE(SUM(reviews.rating = 1), 0) AS stars_1, COALESCE(SUM(reviews.rating = 2), 0) AS stars_2, COALESCE(SUM(reviews.rating = 3), 0) AS stars_3,
+        COALESCE(SUM(reviews.rating = 4), 0) AS stars_4, COALESCE(SUM(reviews.rating = 5), 0) AS stars_5
+    FROM companies LEFT JOIN reviews ON reviews.company_id = companies.id GROUP BY companies.id) AS totals
+WHERE companies.id = totals.company_id
+    AND (companies.number_of_reviews != totals.count OR companies.points_total != totals.total
+    OR abs(companies.current_score - CASE WHEN totals.count > 0 THEN CAST(totals.total AS REAL) / totals.count ELSE 0.0 END) > 1e-9
+    OR companies.stars_1 != totals.stars_1 OR companies.stars_2 != totals.stars_2 OR companies.stars_3 != totals.stars_3
+    OR companies.stars_4 != totals.stars_4 OR companies.stars_5 != totals.stars_5)
+"""
+
+
+# (version, name, steps) - a step is a SQL statement or a function taking the database
+MIGRATIONS = [
+    (
+        1,
+        "indexes for the hot paths",
+        [
+            # reviews of one company and reviews of one user, in time order
+            "CREATE INDEX IF NOT EXISTS reviews_company_id_date_time ON reviews(company_id, date_time)",
+            "CREATE INDEX IF NOT EXISTS reviews_user_id_date_time ON reviews(user_id, date_time)",
+            # the home feed is read newest first and paginated by (date_time, id) - this index serves both the order and the cursor
+            "CREATE INDEX IF NOT EXISTS reviews_date_time_id ON reviews(date_time, id)",
+            # the moderation queue in time order
+            "CREATE INDEX IF NOT EXISTS temp_reviews_date_time ON temp_reviews(date_time)",
+            # the admin and the anonymous user are looked up by role
+            "CREATE INDEX IF NOT EXISTS users_role ON users(role)",
+        ],
+    ),
+    (
+        2,
+        "data versions",
+        [
+            # version counters of tables whose contents are cached in memory. Triggers bump them, so every worker sees changes made by the others
+            "CREATE TABLE IF NOT EXISTS data_versions (name TEXT PRIMARY KEY NOT NULL, version INTEGER NOT NULL DEFAULT 0)",
+            "INSERT OR IGNORE INTO data_versions (name) VALUES ('companies')",
+            "CREATE TRIGGER IF NOT EXISTS companies_version_insert AFTER INSERT ON companies BEGIN UPDATE data_versions SET version = version + 1 WHERE name = 'companies'; END",
+            "CREATE TRIGGER IF NOT EXISTS companies_version_delete AFTER DELETE ON companies BEGIN UPDATE data_versions SET version = version + 1 WHERE name = 'companies'; END",
+            "CREATE TRIGGER IF NOT EXISTS companies_version_update AFTER UPDATE OF company_name ON companies BEGIN UPDATE data_versions SET version = version + 1 WHERE name = 'companies'; END",
+        ],
+    ),
+    (
+        3,
+        "full text search of reviews",
+        [
+            # full text index over the approved reviews. It only stores the index, the text itself stays in reviews. Diacritics are removed so that "cena" also finds "céna" and the other way around
+            "CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(review_text, content='reviews', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+            "CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN INSERT INTO reviews_fts (rowid, review_text) VALUES (new.id, new.review_text); END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN INSERT INTO reviews_fts (reviews_fts, rowid, review_text) VALUES ('delete', old.id, old.review_text); END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE OF review_text ON reviews BEGIN INSERT INTO reviews_fts (reviews_fts, rowid, review_text) VALUES ('delete', old.id, old.review_text); INSERT INTO reviews_fts (rowid, review_text) VALUES (new.id, new.review_text); END",
+            # index the reviews that already exist
+            "INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')",
+        ],
+    ),
+    (
+        4,
+        "email outbox",
+        [
+            # emails waiting to be sent by the background sender (see outbox.py). recipients is a json list
+            "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, subject TEXT NOT NULL, recipients TEXT NOT NULL, body TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, next_attempt NUMERIC NOT NULL, last_error TEXT, created NUMERIC NOT NULL, sent NUMERIC)",
+            "CREATE INDEX IF NOT EXISTS outbox_status_next_attempt ON outbox(status, next_attempt)",
+        ],
+    ),
+    (
+        5,
+        "email deliverability status",
+        [
+            # whether the domain of the email adress is known to receive mail - 'verified', 'pending' or 'undeliverable' (see email_check.py)
+            add_column("users", "email_status", "TEXT NOT NULL DEFAULT 'verified'"),
+            # accounts waiting for the background check of their email domain
+            "CREATE INDEX IF NOT EXISTS users_email_status_pending ON users(email_status) WHERE email_status = 'pending'",
+        ],
+    ),
+    (
+        6,
+        "rating aggregates maintained by triggers",
+        [
+            # rating aggregates of the companies count only the approved reviews - every change of the reviews table updates them in the same transaction
+            "CREATE TRIGGER IF NOT EXISTS reviews_aggregate_insert AFTER INSERT ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews + 1, points_total = points_total + new.rating, current_score = CAST(points_total + new.rating AS REAL) / (number_of_reviews + 1) WHERE id = new.company_id; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_aggregate_delete AFTER DELETE ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews - 1, points_total = points_total - old.rating, current_score = CASE WHEN number_of_reviews > 1 THEN CAST(points_total - old.rating AS REAL) / (number_of_reviews - 1) ELSE 0.0 END WHERE id = old.company_id; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_aggregate_update AFTER UPDATE OF rating, company_id ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews - 1, points_total = points_total - old.rating, current_score = CASE WHEN number_of_reviews > 1 THEN CAST(points_total - old.rating AS REAL) / (number_of_reviews - 1) ELSE 0.0 END WHERE id = old.company_id; UPDATE companies SET number_of_reviews = number_of_reviews + 1, points_total = points_total + new.rating, current_score = CAST(points_total + new.rating AS REAL) / (number_of_reviews + 1) WHERE id = new.company_id; END",
+            # the aggregates used to be counted before moderation and were never corrected - start from the actual numbers
+            RECOMPUTE_SCORES,
+        ],
+    ),
+    (
+        7,
+        "data versions of reviews with the time of the change",
+        [
+            # unix time of the last change - used for the Last-Modified header of the public pages
+            add_column("data_versions", "changed", "INTEGER NOT NULL DEFAULT 0"),
+            "UPDATE data_versions SET changed = CAST(strftime('%s', 'now') AS INTEGER)",
+            "INSERT OR IGNORE INTO data_versions (name, changed) VALUES ('reviews', CAST(strftime('%s', 'now') AS INTEGER))",
+            "DROP TRIGGER IF EXISTS companies_version_insert",
+            "DROP TRIGGER IF EXISTS companies_version_delete",
+            "DROP TRIGGER IF EXISTS companies_version_update",
+            "CREATE TRIGGER companies_version_insert AFTER INSERT ON companies BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'companies'; END",
+            "CREATE TRIGGER companies_version_delete AFTER DELETE ON companies BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'companies'; END",
+            "CREATE TRIGGER companies_version_update AFTER UPDATE OF company_name ON companies BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'companies'; END",
+            # approved reviews - added, edited, anonymized or deleted
+            "CREATE TRIGGER IF NOT EXISTS reviews_version_insert AFTER INSERT ON reviews BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'reviews'; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_version_delete AFTER DELETE ON reviews BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'reviews'; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_version_update AFTER UPDATE ON reviews BEGIN UPDATE data_versions SET version = version + 1, changed = CAST(strftime('%s', 'now') AS INTEGER) WHERE name = 'reviews'; END",
+        ],
+    ),
+    (
+        8,
+        "version of every company's reviews",
+        [
+            # bumped whenever an approved review of the company is added, edited, anonymized or deleted - the rendered company page is cached under it (see fragment_cache.py)
+            add_column("companies", "version", "INTEGER NOT NULL DEFAULT 0"),
+            "CREATE TRIGGER IF NOT EXISTS reviews_company_version_insert AFTER INSERT ON reviews BEGIN UPDATE companies SET version = version + 1 WHERE id = new.company_id; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_company_version_delete AFTER DELETE ON reviews BEGIN UPDATE companies SET version = version + 1 WHERE id = old.company_id; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_company_version_update AFTER UPDATE ON reviews BEGIN UPDATE companies SET version = version + 1 WHERE id IN (old.company_id, new.company_id); END",
+        ],
+    ),
+    (
+        9,
+        "index for the company pages sorted by rating",
+        [
+            # the reviews of a company by rating and time - serves the highest/lowest orders and the filter by stars. The newest/oldest orders use reviews_company_id_date_time
+            "CREATE INDEX IF NOT EXISTS reviews_company_id_rating_date_time ON reviews(company_id, rating, date_time)",
+        ],
+    ),
+    (
+        10,
+        "czech sorting key of the company names",
+        [
+            # czech_key() of the name, so that companies can be sorted alphabetically with ORDER BY sort_key. It is set by the code that adds a company
+            add_column("companies", "sort_key", "TEXT"),
+            fill_sort_keys,
+            "CREATE INDEX IF NOT EXISTS companies_sort_key ON companies(sort_key)",
+        ],
+    ),
+    (
+        11,
+        "browsing companies by type and region",
+        [
+            # number of companies of every type in every region, kept up to date by the triggers below. Facet counts are summed from it instead of grouping the whole companies table
+            "CREATE TABLE IF NOT EXISTS company_facets (company_type TEXT NOT NULL, company_location TEXT NOT NULL, companies INTEGER NOT NULL, PRIMARY KEY (company_type, company_location)) WITHOUT ROWID",
+            "DELETE FROM company_facets",
+            "INSERT INTO company_facets (company_type, company_location, companies) SELECT company_type, company_location, COUNT(*) FROM companies GROUP BY company_type, company_location",
+            "CREATE TRIGGER IF NOT EXISTS companies_facets_insert AFTER INSERT ON companies BEGIN INSERT INTO company_facets (company_type, company_location, companies) VALUES (new.company_type, new.company_location, 1) ON CONFLICT (company_type, company_location) DO UPDATE SET companies = companies + 1; END",
+            "CREATE TRIGGER IF NOT EXISTS companies_facets_delete AFTER DELETE ON companies BEGIN UPDATE company_facets SET companies = companies - 1 WHERE company_type = old.company_type AND company_location = old.company_location; DELETE FROM company_facets WHERE company_type = old.company_type AND company_location = old.company_location AND companies <= 0; END",
+            "CREATE TRIGGER IF NOT EXISTS companies_facets_update AFTER UPDATE OF company_type, company_location ON companies BEGIN UPDATE company_facets SET companies = companies - 1 WHERE company_type = old.company_type AND company_location = old.company_location; DELETE FROM company_facets WHERE company_type = old.company_type AND company_location = old.company_location AND companies <= 0; INSERT INTO company_facets (company_type, company_location, companies) VALUES (new.company_type, new.company_location, 1) ON CONFLICT (company_type, company_location) DO UPDATE SET companies = companies + 1; END",
+            # the browse page lists companies of a type or of a region, the best rated or the most reviewed first
+            "CREATE INDEX IF NOT EXISTS companies_score ON companies(current_score)",
+            "CREATE INDEX IF NOT EXISTS companies_type_score ON companies(company_type, current_score)",
+            "CREATE INDEX IF NOT EXISTS companies_location_score ON companies(company_location, current_score)",
+            "CREATE INDEX IF NOT EXISTS companies_number_of_reviews ON companies(number_of_reviews)",
+            "CREATE INDEX IF NOT EXISTS companies_type_number_of_reviews ON companies(company_type, number_of_reviews)",
+            "CREATE INDEX IF NOT EXISTS companies_location_number_of_reviews ON companies(company_location, number_of_reviews)",
+        ],
+    ),
+    (
+        12,
+        "row counts of the review tables",
+        [
+            # number of rows of the tables the admin console summarizes, kept up to date by triggers - counting a large table reads all of it
+            "CREATE TABLE IF NOT EXISTS table_counts (name TEXT PRIMARY KEY NOT NULL, count INTEGER NOT NULL) WITHOUT ROWID",
+            "INSERT OR REPLACE INTO table_counts (name, count) SELECT 'reviews', COUNT(*) FROM reviews",
+            "INSERT OR REPLACE INTO table_counts (name, count) SELECT 'temp_reviews', COUNT(*) FROM temp_reviews",
+            "CREATE TRIGGER IF NOT EXISTS reviews_count_insert AFTER INSERT ON reviews BEGIN UPDATE table_counts SET count = count + 1 WHERE name = 'reviews'; END",
+            "CREATE TRIGGER IF NOT EXISTS reviews_count_delete AFTER DELETE ON reviews BEGIN UPDATE table_counts SET count = count - 1 WHERE name = 'reviews'; END",
+            "CREATE TRIGGER IF NOT EXISTS temp_reviews_count_insert AFTER INSERT ON temp_reviews BEGIN UPDATE table_counts SET count = count + 1 WHERE name = 'temp_reviews'; END",
+            "CREATE TRIGGER IF NOT EXISTS temp_reviews_count_delete AFTER DELETE ON temp_reviews BEGIN UPDATE table_counts SET count = count - 1 WHERE name = 'temp_reviews'; END",
+            # the queue filtered by company or user, in time order
+            "CREATE INDEX IF NOT EXISTS temp_reviews_company_id_date_time ON temp_reviews(company_id, date_time)",
+            "CREATE INDEX IF NOT EXISTS temp_reviews_user_id_date_time ON temp_reviews(user_id, date_time)",
+        ],
+    ),
+    (
+        13,
+        "number of reviews with each number of stars",
+        [
+            # the rating distribution of the companies, counted like the other aggregates - only approved reviews, updated by the triggers in the same transaction
+            add_column("companies", "stars_1", "INTEGER NOT NULL DEFAULT 0"),
+            add_column("companies", "stars_2", "INTEGER NOT NULL DEFAULT 0"),
+            add_column("companies", "stars_3", "INTEGER NOT NULL DEFAULT 0"),
+            add_column("companies", "stars_4", "INTEGER NOT NULL DEFAULT 0"),
+            add_column("companies", "stars_5", "INTEGER NOT NULL DEFAULT 0"),
+            "DROP TRIGGER IF EXISTS reviews_aggregate_insert",
+            "DROP TRIGGER IF EXISTS reviews_aggregate_delete",
+            "DROP TRIGGER IF EXISTS reviews_aggregate_update",
+            "CREATE TRIGGER reviews_aggregate_insert AFTER INSERT ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews + 1, points_total = points_total + new.rating, current_score = CAST(points_total + new.rating AS REAL) / (number_of_reviews + 1), stars_1 = stars_1 + (new.rating = 1), stars_2 = stars_2 + (new.rating = 2), stars_3 = stars_3 + (new.rating = 3), stars_4 = stars_4 + (new.rating = 4), stars_5 = stars_5 + (new.rating = 5) WHERE id = new.company_id; END",
+            "CREATE TRIGGER reviews_aggregate_delete AFTER DELETE ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews - 1, points_total = points_total - old.rating, current_score = CASE WHEN number_of_reviews > 1 THEN CAST(points_total - old.rating AS REAL) / (number_of_reviews - 1) ELSE 0.0 END, stars_1 = stars_1 - (old.rating = 1), stars_2 = stars_2 - (old.rating = 2), stars_3 = stars_3 - (old.rating = 3), stars_4 = stars_4 - (old.rating = 4), stars_5 = stars_5 - (old.rating = 5) WHERE id = old.company_id; END",
+            "CREATE TRIGGER reviews_aggregate_update AFTER UPDATE OF rating, company_id ON reviews BEGIN UPDATE companies SET number_of_reviews = number_of_reviews - 1, points_total = points_total - old.rating, current_score = CASE WHEN number_of_reviews > 1 THEN CAST(points_total - old.rating AS REAL) / (number_of_reviews - 1) ELSE 0.0 END, stars_1 = stars_1 - (old.rating = 1), stars_2 = stars_2 - (old.rating = 2), stars_3 = stars_3 - (old.rating = 3), stars_4 = stars_4 - (old.rating = 4), stars_5 = stars_5 - (old.rating = 5) WHERE id = old.company_id; UPDATE companies SET number_of_reviews = number_of_reviews + 1, points_total = points_total + new.rating, current_score = CAST(points_total + new.rating AS REAL) / (number_of_reviews + 1), stars_1 = stars_1 + (new.rating = 1), stars_2 = stars_2 + (new.rating = 2), stars_3 = stars_3 + (new.rating = 3), stars_4 = stars_4 + (new.rating = 4), stars_5 = stars_5 + (new.rating = 5) WHERE id = new.company_id; END",
+            RECOMPUTE_STARS,
+            # the cached company pages were rendered without the distribution
+            "UPDATE companies SET version = version + 1",
+        ],
+    ),
+    (
+        14,
+        "leaderboards of the companies",
+        [
+            # the prior of the Bayesian average - the mean rating of all approved reviews and how many of them every company is assumed to have (see leaderboard.py). One row
+            "CREATE TABLE IF NOT EXISTS leaderboard_prior (id INTEGER PRIMARY KEY CHECK (id = 1), mean REAL NOT NULL, weight REAL NOT NULL)",
+            # the score of every company with an approved review. Type and region are copied here so that each ranking is read from one index in order
+            "CREATE TABLE IF NOT EXISTS leaderboard (company_id INTEGER PRIMARY KEY NOT NULL, company_type TEXT NOT NULL, company_location TEXT NOT NULL, number_of_reviews INTEGER NOT NULL, score REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS leaderboard_score ON leaderboard(score)",
+            "CREATE INDEX IF NOT EXISTS leaderboard_type_score ON leaderboard(company_type, score)",
+            "CREATE INDEX IF NOT EXISTS leaderboard_location_score ON leaderboard(company_location, score)",
+            # the aggregates of a company change with its reviews (through the reviews_aggregate_* triggers) - its score is computed again with the stored prior
+            "CREATE TRIGGER IF NOT EXISTS companies_leaderboard_update AFTER UPDATE OF number_of_reviews, points_total, company_type, company_location ON companies BEGIN DELETE FROM leaderboard WHERE company_id = old.id; INSERT INTO leaderboard (company_id, company_type, company_location, number_of_reviews, score) SELECT new.id, new.company_type, new.company_location, new.number_of_reviews, (weight * mean + new.points_total) / (weight + new.number_of_reviews) FROM leaderboard_prior WHERE new.number_of_reviews > 0; END",
+            "CREATE TRIGGER IF NOT EXISTS companies_leaderboard_delete AFTER DELETE ON companies BEGIN DELETE FROM leaderboard WHERE company_id = old.id; END",
+            # bumped when the prior is computed again, which changes every score
+            "INSERT OR IGNORE INTO data_versions (name, changed) VALUES ('leaderboard', CAST(strftime('%s', 'now') AS INTEGER))",
+            # the first prior - the mean rating of all approved reviews and a weight of 10 reviews, as in leaderboard.py when this migration was written
+            "INSERT OR REPLACE INTO leaderboard_prior (id, mean, weight) SELECT 1, COALESCE(CAST(SUM(points_total) AS REAL) / NULLIF(SUM(number_of_reviews), 0), 3.0), 10 FROM companies",
+            "DELETE FROM leaderboard",
+            "INSERT INTO leaderboard (company_id, company_type, company_location, number_of_reviews, score) SELECT companies.id, companies.company_type, companies.company_location, companies.number_of_reviews, (leaderboard_prior.weight * leaderboard_prior.mean + companies.points_total) / (leaderboard_prior.weight + companies.number_of_reviews) FROM companies, leaderboard_prior WHERE companies.number_of_reviews > 0",
+        ],
+    ),
+    (
+        15,
+        "folded company names for the suggestions",
+        [
+            # the name folded by company_names.fold() and the parts of it starting at its further words. They are set by the code that adds a company
+            # the suggestions rank every company whose name (or a further word of it) starts with the input by the number of reviews - these serve the range search
+            add_column("companies", "name_key", "TEXT"),
+            "CREATE TABLE IF NOT EXISTS company_words (word TEXT NOT NULL, company_id INTEGER NOT NULL, PRIMARY KEY (word, company_id)) WITHOUT ROWID",
+            fill_name_keys,
+            "CREATE INDEX IF NOT EXISTS companies_name_key ON companies(name_key)",
+            "CREATE INDEX IF NOT EXISTS company_words_company_id ON company_words(company_id)",
+            "CREATE TRIGGER IF NOT EXISTS companies_words_delete AFTER DELETE ON companies BEGIN DELETE FROM company_words WHERE company_id = old.id; END",
+        ],
+    ),
+]
+
+
+def current_version(db):
+    """Version of the newest migration applied to the database, 0 if none"""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY NOT NULL, name TEXT NOT NULL, applied NUMERIC NOT NULL)"
+    )
+    rows = db.execute("SELECT MAX(version) AS version FROM schema_migrations")
+    return rows[0]["version"] or 0
+
+
+def pending(db):
+    """Migrations not applied to the database yet"""
+    version = current_version(db)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def backup(db, path):
+    """Copy the whole database into a file, e.g. before migrating"""
+    target = sqlite3.connect(path)
+    try:
+        db.connection().backup(target)
+    finally:
+        target.close()
+
+
+def migrate(db, log=None):
+    """Apply the pending migrations. Returns the list of the versions applied."""
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        with db.transaction():
+            # checked inside the transaction - another worker starting at the same time may have applied it already
+            if version <= current_version(db):
+                continue
+            for step in steps:
+                if callable(step):
+                    step(db)
+                else:
+                    db.execute(step)
+            db.execute(
+                "INSERT INTO schema_migrations (version, name, applied) VALUES (?, ?, ?)",
+                version,
+                name,
+                datetime.datetime.now(),
+            )
+        applied.append(version)
+        if log:
+            log(f"Applied migration {version}: {name}")
+    return applied
@@ -0,0 +1,171 @@
+import collections
+import datetime
+import json
+import smtplib
+import threading
+import time
+from flask_mail import BadHeaderError, Message
+
+
+class Outbox:
+    """
+    Persistent queue of outgoing emails.
+    Request handlers only store the message in the outbox table. A background sender (a thread started with start_worker() or the 'flask send-mail' command) sends the pending messages in batches over one SMTP connection, retries failed ones with exponential backoff and gives up on a message after max_attempts (status 'dead').
+    More senders can run at once - each message is claimed by one of them before it is sent.
+    """
+
+    def __init__(self, app, db, mail, sender, batch_size=50, max_attempts=6, backoff=30, lease=600):
+        self.app = app
+        self.db = db
+        self.mail = mail
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # seconds before the first retry - doubled with every further attempt
+        self.backoff = backoff
+        # seconds a claimed message may stay unsent before another sender takes it over (e.g. after a crash)
+        self.lease = lease
+        # set when a message is enqueued so that the worker thread does not wait for its interval
+        self.wakeup = threading.Event()
+        # SMTP send times of the last messages sent by this process, in seconds
+        self.latencies = collections.deque(maxlen=1000)
+
+    def enqueue(self, msg):
+        """Store a flask_mail Message to be sent by the background sender"""
+        self.db.execute(
+            "INSERT INTO outbox (subject, recipients, body, next_attempt, created) VALUES (?, ?, ?, ?, ?)",
+            msg.subject,
+            json.dumps(msg.recipients),
+            msg.body,
+            datetime.datetime.now(),
+            datetime.datetime.now(),
+        )
+        # inside a transaction the sender could not see the message before it is committed
+        self.db.after_commit(self.wakeup.set)
+
+    def _claim(self, message_id):
+        """Take a pending message for this sender. Returns False if another sender was faster."""
+        taken = self.db.execute(
+            "UPDATE outbox SET status = 'sending', next_attempt = ? WHERE id = ? AND status = 'pending'",
+            datetime.datetime.now() + datetime.timedelta(seconds=self.lease),
+            message_id,
+        )
+        return taken == 1
+
+    def _sent(self, row, latency):
+        self.latencies.append(latency)
+        self.db.execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent = ?, last_error = NULL WHERE id = ?",
+            datetime.datetime.now(),
+            row["id"],
+        )
+
+    def _failed(self, row, error, permanent=False):
+        """Schedule the message for another attempt, or give up on it"""
+        attempts = row["attempts"] + 1
+        if permanent or attempts >= self.max_attempts:
+            self.db.execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                attempts,
+                str(error),
+                row["id"],
+            )
+            self.app.logger.error("Email %s could not be sent and was given up: %s", row["id"], error)
+        else:
+            next_attempt = datetime.datetime.now() + datetime.timedelta(
+                seconds=self.backoff * 2 ** (attempts - 1)
+            )
+            self.db.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                attempts,
+                next_attempt,
+                str(error),
+                row["id"],
+            )
+            self.app.logger.warning("Email %s could not be sent, next attempt at %s: %s", row["id"], next_attempt, error)
+
+    def send_pending(self):
+        """Send one batch of messages that are due. Returns the number of messages sent."""
+        now = datetime.datetime.now()
+        # messages claimed by a sender that did not finish them go back to the queue
+        self.db.execute(
+            "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND next_attempt <= ?",
+            now,
+        )
+        rows = self.db.execute(
+            "SELECT id, subject, recipients, body, attempts FROM outbox WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+            now,
+            self.batch_size,
+        )
+        remaining = [row for row in rows if self._claim(row["id"])]
+        if not remaining:
+            return 0
+
+        sent = 0
+        try:
+            # one connection (one TLS handshake and login) for the whole batch
+            with self.mail.connect() as connection:
+                while remaining:
+                    row = remaining[0]
+                    msg = Message(
+                        row["subject"],
+                        sender=self.sender,
+                        recipients=json.loads(row["recipients"]),
+                    )
+                    msg.body = row["body"]
+                    start = time.perf_counter()
+                    try:
+                        connection.send(msg)
+                    except (smtplib.SMTPRecipientsRefused, BadHeaderError, AssertionError) as error:
+                        # the server will never accept these recipients or the message itself is broken - no point in trying again
+                        remaining.pop(0)
+                        self._failed(row, error, permanent=True)
+                        continue
+                    remaining.pop(0)
+                    self._sent(row, time.perf_counter() - start)
+                    sent += 1
+        # the server is not reachable or the connection broke - everything not sent yet is tried again later
+        except (smtplib.SMTPException, OSError) as error:
+            for row in remaining:
+                self._failed(row, error)
+        return sent
+
+    def run(self, interval=10, stop=None):
+        """Keep sending until stopped. Waits for the interval or for a new message between batches."""
+        while stop is None or not stop.is_set():
+            try:
+                with self.app.app_context():
+                    # keep going while there are full batches waiting
+                    while self.send_pending() == self.batch_size:
+                        pass
+            except Exception:
+                self.app.logger.exception("Sending emails from the outbox failed")
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+    def start_worker(self, interval=10):
+        """Send emails from a daemon thread of this process"""
+        thread = threading.Thread(target=self.run, args=(interval,), name="outbox", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Queue depth and latencies of the outbox"""
+        counts = self.db.execute("SELECT status, COUNT(*) AS count FROM outbox WHERE status IN ('pending', 'sending', 'dead') GROUP BY status")
+        stats = {"pending": 0, "sending": 0, "dead": 0}
+        for row in counts:
+            stats[row["status"]] = row["count"]
+        oldest = self.db.execute("SELECT MIN(created) AS created FROM outbox WHERE status IN ('pending', 'sending')")
+        # how long the messages sent within the last hour waited in the queue, in seconds
+        delivery = self.db.execute(
+            "SELECT COUNT(*) AS count, AVG((julianday(sent) - julianday(created)) * 86400) AS delay FROM outbox WHERE status = 'sent' AND sent >= ?",
+            datetime.datetime.now() - datetime.timedelta(hours=1),
+        )
+        stats["oldest_pending"] = oldest[0]["created"]
+        stats["sent_last_hour"] = delivery[0]["count"]
+        stats["average_delay_last_hour"] = delivery[0]["delay"]
+        latencies = sorted(self.latencies)
+        if latencies:
+            stats["smtp_send_average"] = sum(latencies) / len(latencies)
+            stats["smtp_send_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return stats
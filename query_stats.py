@@ -0,0 +1,108 @@
+import collections
+import logging
+import threading
+from flask import g, has_request_context, request
+
+
+class QueryStats:
+    """
+    Per-request statistics of the SQL statements run through the Database layer.
+    Every request counts its statements, their total time and the slowest one. A statement run n_plus_one times or more with different arguments in one request is flagged as N+1 - usually a query in a loop that could be one query with "IN (?)" or a join.
+    The numbers are added up per route in this process and shown on /admin_diagnostics. Statements slower than slow_threshold seconds are logged (into log_path if given) without their arguments, which may contain emails or hashes.
+    """
+
+    def __init__(self, app, db, slow_threshold=0.1, n_plus_one=3, log_path=None, recent=100):
+        self.app = app
+        self.slow_threshold = slow_threshold
+        self.n_plus_one = n_plus_one
+        self.lock = threading.Lock()
+        # route -> totals of its requests
+        self.routes = {}
+        # the last slow statements, newest last
+        self.slow = collections.deque(maxlen=recent)
+        self.logger = logging.getLogger("slow_queries")
+        if log_path:
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.WARNING)
+        db.on_query = self.record
+        app.after_request(self.finish)
+
+    def record(self, sql, args, seconds):
+        """Called by the Database after every statement"""
+        in_request = has_request_context()
+        if in_request:
+            stats = g.get("query_stats")
+            if stats is None:
+                stats = g.query_stats = {"count": 0, "time": 0.0, "slowest": None, "slowest_time": 0.0, "statements": {}}
+            stats["count"] += 1
+            stats["time"] += seconds
+            if seconds >= stats["slowest_time"]:
+                stats["slowest"] = sql
+                stats["slowest_time"] = seconds
+            # distinct arguments of every statement - only needed to spot N+1, so at most a few are kept
+            arguments = stats["statements"].setdefault(sql, set())
+            if len(arguments) < self.n_plus_one:
+                arguments.add(repr(args))
+        if seconds >= self.slow_threshold:
+            route = f"{request.method} {request.path}" if in_request else "background"
+            with self.lock:
+                self.slow.append({"route": route, "ms": round(seconds * 1000, 2), "sql": sql})
+            self.logger.warning("%.1f ms %s %s", seconds * 1000, route, sql)
+
+    def finish(self, response):
+        """Add the statistics of the request to the totals of its route"""
+        stats = g.pop("query_stats", None)
+        if stats is None:
+            return response
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else '(no route)'}"
+        repeated = [sql for sql, arguments in stats["statements"].items() if len(arguments) >= self.n_plus_one]
+        with self.lock:
+            totals = self.routes.get(route)
+            if totals is None:
+                totals = self.routes[route] = {
+                    "requests": 0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "sql_ms": 0.0,
+                    "max_sql_ms": 0.0,
+                    "slowest_ms": 0.0,
+                    "slowest_sql": None,
+                    "n_plus_one_requests": 0,
+                    "n_plus_one_sql": [],
+                }
+            totals["requests"] += 1
+            totals["queries"] += stats["count"]
+            totals["max_queries"] = max(totals["max_queries"], stats["count"])
+            totals["sql_ms"] += stats["time"] * 1000
+            totals["max_sql_ms"] = max(totals["max_sql_ms"], stats["time"] * 1000)
+            if stats["slowest_time"] * 1000 >= totals["slowest_ms"]:
+                totals["slowest_ms"] = stats["slowest_time"] * 1000
+                totals["slowest_sql"] = stats["slowest"]
+            if repeated:
+                totals["n_plus_one_requests"] += 1
+                for sql in repeated:
+                    if sql not in totals["n_plus_one_sql"]:
+                        totals["n_plus_one_sql"].append(sql)
+        # the browser's developer tools show this next to the timing of the request
+        response.headers["Server-Timing"] = f'db;dur={stats["time"] * 1000:.2f};desc="{stats["count"]} queries"'
+        return response
+
+    def report(self):
+        """Totals per route, the routes spending the most time in SQL first, and the last slow statements"""
+        with self.lock:
+            routes = []
+            for route, totals in self.routes.items():
+                row = dict(totals, route=route, n_plus_one_sql=list(totals["n_plus_one_sql"]))
+                row["avg_queries"] = round(totals["queries"] / totals["requests"], 2)
+                row["avg_sql_ms"] = round(totals["sql_ms"] / totals["requests"], 3)
+                routes.append(row)
+            slow = list(reversed(self.slow))
+        routes.sort(key=lambda row: row["sql_ms"], reverse=True)
+        return {"routes": routes, "slow_queries": slow, "slow_threshold_ms": self.slow_threshold * 1000}
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+            self.slow.clear()
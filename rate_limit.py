@@ -0,0 +1,132 @@
+"""
+Rate limiting of the routes that are expensive to serve - bcrypt hashing, DNS lookups of email domains and outgoing mail.
+Every limited route has a token bucket per IP adress and another one per logged in user. A bucket holds at most 'count' tokens and is refilled by 'count' tokens per 'seconds'.
+Each request takes a token from all of its buckets - when one of them is empty, the request is rejected before the route runs.
+"""
+import functools
+import os
+import threading
+import time
+from flask import make_response, request, session
+from database import Database
+from functions import apology
+
+
+def parse_limit(text):
+    """A limit written as "count/seconds", e.g. "10/60" for 10 requests a minute"""
+    count, _, seconds = text.partition("/")
+    count, seconds = int(count), float(seconds)
+    if count < 1 or seconds <= 0:
+        raise ValueError(f"invalid rate limit {text!r}")
+    return count, seconds
+
+
+class MemoryStore:
+    """
+    Buckets kept in this process - each worker process counts its own requests.
+    A bucket that has been refilled completely is the same as no bucket, so those are dropped every 1000 requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (tokens, time of the last update, time when the bucket is full again)
+        self.buckets = {}
+        self.takes = 0
+
+    def take(self, keys, count, seconds, now):
+        """Take a token from each of the buckets if all of them have one. Returns 0, or the number of seconds until they will"""
+        rate = count / seconds
+        with self.lock:
+            levels = []
+            for key in keys:
+                bucket = self.buckets.get(key)
+                levels.append(count if bucket is None else min(count, bucket[0] + (now - bucket[1]) * rate))
+            lowest = min(levels)
+            if lowest < 1:
+                return (1 - lowest) / rate
+            for key, tokens in zip(keys, levels):
+                self.buckets[key] = (tokens - 1, now, now + (count - tokens + 1) / rate)
+            self.takes += 1
+            if self.takes % 1000 == 0:
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+            return 0
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class SQLiteStore:
+    """
+    Buckets kept in a separate sqlite file, shared by all worker processes on the machine - a local stand-in for a key-value store.
+    Buckets that have been refilled completely are deleted every 1000 requests.
+    """
+
+    def __init__(self, path):
+        self.db = Database(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, full REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_full ON buckets(full)")
+        self.takes = 0
+
+    def take(self, keys, count, seconds, now):
+        rate = count / seconds
+        # the buckets are read and written in one transaction, so two workers can not take the same token
+        with self.db.transaction():
+            stored = {row["key"]: row for row in self.db.rows("SELECT key, tokens, updated FROM buckets WHERE key IN (?)", list(keys))}
+            levels = []
+            for key in keys:
+                bucket = stored.get(key)
+                levels.append(count if bucket is None else min(count, bucket["tokens"] + (now - bucket["updated"]) * rate))
+            lowest = min(levels)
+            if lowest < 1:
+                return (1 - lowest) / rate
+            for key, tokens in zip(keys, levels):
+                self.db.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated, full) VALUES (?, ?, ?, ?)",
+                    key,
+                    tokens - 1,
+                    now,
+                    now + (count - tokens + 1) / rate,
+                )
+            self.takes += 1
+            if self.takes % 1000 == 0:
+                self.db.execute("DELETE FROM buckets WHERE full <= ?", now)
+            return 0
+
+    def clear(self):
+        self.db.execute("DELETE FROM buckets")
+
+
+class RateLimiter:
+    """
+    Decorate routes with limit() to rate limit them. With store None nothing is limited.
+    The limit of a route can be changed with the environment variable RATE_LIMIT_<NAME>, e.g. RATE_LIMIT_LOGIN=20/60.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def limit(self, name, default, methods=("POST",)):
+        """Decorate a route so that at most default ("count/seconds", see parse_limit()) of its requests with one of the methods are served per IP adress and per user"""
+        count, seconds = parse_limit(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                if self.store is None or request.method not in methods:
+                    return f(*args, **kwargs)
+                keys = [f"{name}:ip:{request.remote_addr}"]
+                if session.get("user_id") is not None:
+                    keys.append(f"{name}:user:{session['user_id']}")
+                wait = self.store.take(keys, count, seconds, time.time())
+                if wait:
+                    response = make_response(apology("Příliš mnoho pokusů. Zkuste to prosím za chvíli znovu.", 429))
+                    response.headers["Retry-After"] = str(int(wait) + 1)
+                    return response
+                return f(*args, **kwargs)
+
+            return decorated_function
+
+        return decorator
@@ -0,0 +1,76 @@
+import csv
+import os
+import threading
+from collation import czech_key
+
+# all regions (kraje) of Czechia, in the usual order starting with Prague
+REGIONS = (
+    "Hlavní město Praha",
+    "Středočeský kraj",
+    "Jihočeský kraj",
+    "Plzeňský kraj",
+    "Karlovarský kraj",
+    "Ústecký kraj",
+    "Liberecký kraj",
+    "Královéhradecký kraj",
+    "Pardubický kraj",
+    "Kraj Vysočina",
+    "Jihomoravský kraj",
+    "Zlínský kraj",
+    "Olomoucký kraj",
+    "Moravskoslezský kraj",
+)
+
+
+def read_company_types(path):
+    """Types of companies from the first column of the csv file, in Czech alphabetical order (see collation.py)"""
+    with open(path, "r", encoding="utf-8") as file:
+        types = {row[0].strip() for row in csv.reader(file) if row and row[0].strip()}
+    return tuple(sorted(types, key=czech_key))
+
+
+class Lists:
+    """
+    One loaded version of the lists the forms offer - never changed, a reload replaces it as a whole.
+    - types, regions: tuples in the order they are shown in
+    - type_set, region_set: the same as frozensets for checking submitted values
+    """
+
+    def __init__(self, types, regions=REGIONS):
+        self.types = types
+        self.type_set = frozenset(types)
+        self.regions = regions
+        self.region_set = frozenset(regions)
+
+
+class ReferenceData:
+    """
+    Types of companies and regions, loaded once and shared by every request of this process.
+    The types come from a csv file so that they can be easily changed - a changed file (by its modification time) is loaded again on the next access, without restarting the app.
+    """
+
+    def __init__(self, types_path):
+        self.types_path = types_path
+        self.lock = threading.Lock()
+        self.mtime = os.stat(types_path).st_mtime_ns
+        self.lists = Lists(read_company_types(types_path))
+
+    def get(self):
+        """The current lists. Keep the returned object for the whole request, so that the types shown and the ones checked are the same"""
+        try:
+            mtime = os.stat(self.types_path).st_mtime_ns
+        except OSError:
+            # the file is being replaced - keep what we have
+            return self.lists
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    try:
+                        types = read_company_types(self.types_path)
+                    except (OSError, UnicodeDecodeError, csv.Error):
+                        return self.lists
+                    # a file caught in the middle of being written may be empty - try again next time
+                    if types:
+                        self.lists = Lists(types)
+                        self.mtime = mtime
+        return self.lists
@@ -0,0 +1,39 @@
+// Fills the datalist of every company search bar with suggestions from /api/companies/suggest while the user types,
+// so that the pages do not have to contain the names of all companies.
+// Usage: <input list="company_names" data-suggest ...> <datalist id="company_names"></datalist>
+document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("input[data-suggest]").forEach(function (input) {
+        const datalist = document.getElementById(input.getAttribute("list"));
+        let timer = null;
+        let controller = null;
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            // wait until the user stops typing for a moment
+            timer = setTimeout(function () {
+                const query = input.value.trim();
+                if (!query) {
+                    datalist.replaceChildren();
+                    return;
+                }
+                // only the answer to the latest input matters
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+                fetch("/api/companies/suggest?q=" + encodeURIComponent(query), { signal: controller.signal })
+                    .then(function (response) {
+                        return response.json();
+                    })
+                    .then(function (suggestions) {
+                        datalist.replaceChildren(...suggestions.map(function (suggestion) {
+                            const option = document.createElement("option");
+                            option.value = suggestion.company_name;
+                            return option;
+                        }));
+                    })
+                    .catch(function () {});
+            }, 150);
+        });
+    });
+});